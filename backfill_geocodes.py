@@ -0,0 +1,122 @@
+"""
+Bulk geocoding backfill for users and doctors without coordinates.
+
+    python backfill_geocodes.py                    # both tables, cache + gazetteer + Nominatim
+    python backfill_geocodes.py --offline          # no network: cache + gazetteer only
+    python backfill_geocodes.py --table doctors --after-id 1200 --batch-size 200
+
+- Rows are read in id order (keyset pages) and each page is written back with one
+  UPDATE ... FROM (VALUES ...) and committed, so an interrupted run loses at most
+  one page. Re-running picks up whatever is still missing; --after-id skips ahead.
+- Identical addresses are resolved once per run; utils.geocode_address adds the
+  persistent cache (including "no result" answers), the offline gazetteer and the
+  1 request/s Nominatim rate limit.
+"""
+import argparse
+import time
+from dotenv import load_dotenv
+
+# Load environment variables before importing modules that read them
+load_dotenv()
+
+import database
+import utils
+
+TABLES = ('users', 'doctors')
+
+MISSING_COORDS = "(lat IS NULL OR lng IS NULL OR lat = 0 OR lng = 0)"
+
+
+def backfill_table(table, stats, resolved, batch_size=100, after_id=0, network=True, dry_run=False):
+    last_id = after_id
+    while True:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, address, city, pincode FROM {table} WHERE {MISSING_COORDS} AND id > %s ORDER BY id LIMIT %s",
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.commit()
+        if not rows:
+            return
+
+        updates = []
+        for row_id, address, city, pincode in rows:
+            stats['rows'] += 1
+            key = utils.normalize_geocode_query(f"{address or ''}, {city or ''}, {pincode or ''}")
+            if key not in resolved:
+                stats['unique'] += 1
+                before = utils.nominatim_request_count()
+                resolved[key] = utils.geocode_address(address, city, pincode, network=network) if key else (None, None)
+                if utils.nominatim_request_count() == before:
+                    stats['local'] += 1
+            else:
+                stats['duplicates'] += 1
+
+            lat, lng = resolved[key]
+            if lat is not None and lng is not None:
+                updates.append((row_id, lat, lng))
+            else:
+                stats['unresolved'] += 1
+
+        if updates and not dry_run:
+            with database.connection() as conn:
+                cursor = conn.cursor()
+                database.execute_values(
+                    cursor,
+                    f"""
+                    UPDATE {table} AS t SET lat = v.lat, lng = v.lng
+                    FROM (VALUES %s) AS v(id, lat, lng)
+                    WHERE t.id = v.id
+                    """,
+                    updates,
+                    page_size=batch_size,
+                    template="(%s, %s::float8, %s::float8)"
+                )
+                stats['updated'] += cursor.rowcount
+                conn.commit()
+                cursor.close()
+
+        last_id = rows[-1][0]
+        elapsed = time.monotonic() - stats['started']
+        print(f"  {table}: up to id {last_id} | {stats['rows']} rows, {stats['updated']} updated, "
+              f"{stats['rows'] / elapsed:.1f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill in missing lat/lng for users and doctors.")
+    parser.add_argument('--table', choices=TABLES + ('all',), default='all')
+    parser.add_argument('--batch-size', type=int, default=100, help="rows per page / UPDATE statement")
+    parser.add_argument('--after-id', type=int, default=0, help="resume after this id")
+    parser.add_argument('--offline', action='store_true', help="never call Nominatim (cache + gazetteer only)")
+    parser.add_argument('--dry-run', action='store_true', help="resolve addresses but don't write")
+    args = parser.parse_args()
+
+    tables = TABLES if args.table == 'all' else (args.table,)
+    stats = {'rows': 0, 'unique': 0, 'duplicates': 0, 'local': 0, 'unresolved': 0, 'updated': 0,
+             'started': time.monotonic()}
+    resolved = {}  # normalized address -> (lat, lng), shared across tables
+
+    print("🔄 Backfilling coordinates" + (" (offline)" if args.offline else "") + (" [dry run]" if args.dry_run else ""))
+    try:
+        for table in tables:
+            backfill_table(table, stats, resolved, batch_size=args.batch_size, after_id=args.after_id,
+                           network=not args.offline, dry_run=args.dry_run)
+    except KeyboardInterrupt:
+        print("⚠️ Interrupted: completed pages are committed, re-run to continue.")
+
+    elapsed = max(time.monotonic() - stats['started'], 1e-9)
+    unique = max(stats['unique'], 1)
+    print("✅ Done" if not args.dry_run else "✅ Done (nothing written)")
+    print(f"   Rows scanned:       {stats['rows']} ({stats['rows'] / elapsed:.1f} rows/s, {elapsed:.1f}s)")
+    print(f"   Unique addresses:   {stats['unique']} ({stats['duplicates']} duplicate rows reused)")
+    print(f"   Cache/gazetteer:    {stats['local']} ({100.0 * stats['local'] / unique:.0f}% of unique addresses)")
+    print(f"   Nominatim requests: {utils.nominatim_request_count()}")
+    print(f"   Unresolved rows:    {stats['unresolved']}")
+    print(f"   Rows updated:       {stats['updated']}")
+
+
+if __name__ == "__main__":
+    main()
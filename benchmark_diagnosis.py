@@ -0,0 +1,284 @@
+"""
+End-to-end benchmark of the /predict diagnosis pipeline: rules engine -> model
+backend -> helper(), on a labeled corpus built from symptoms_df_clean.csv.
+
+    python benchmark_diagnosis.py                              # current INFERENCE_BACKEND
+    python benchmark_diagnosis.py --backend linear --output after.json --compare before.json
+    python benchmark_diagnosis.py --backend none               # rules only
+    python benchmark_diagnosis.py --via-app                    # model stage through main.get_predicted_value
+
+- Corpus: per disease, random symptom subsets in plain-English sentence patterns,
+  plus a Hinglish / alias variant where symptoms are swapped for phrases from
+  RulesEngine.global_aliases that map back to them. Same --seed, same corpus.
+- Each text goes through the same decisions as /predict (emergency, General
+  Physician fallback, should_run_model, allowed_diseases), timed per stage.
+- By default the model stage calls the bare classifier, so it measures the backend
+  alone: no MicroBatcher and no prediction_cache. --via-app calls
+  main.get_predicted_value instead (the app's INFERENCE_BACKEND, batcher and cache,
+  so repeated texts become cache hits) and adds the cache stats to the report.
+- Report (JSON, benchmarks/benchmark_report.json by default): latency percentiles
+  per stage, throughput, peak RSS, top-1 / top-2 accuracy overall, per variant and
+  for rules alone. --compare prints the change against an earlier report.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+# main.py must not warm up its own copy of the model in the background
+os.environ.setdefault("MODEL_WARMUP", "lazy")
+
+import numpy as np
+
+import inference
+import main
+from rules_engine import RulesEngine
+
+DATA_PATH = "symptoms_df_clean.csv"
+ENGLISH_PATTERNS = ["I have {}", "Experiencing {}", "My symptoms are {}", "{}", "I feel {}", "Doctor I have {}"]
+HINGLISH_PATTERNS = ["mujhe {} hai", "{} ho raha hai", "{}", "I have {}"]
+FALLBACK = "General Physician Consultation"
+EMERGENCY = "EMERGENCY ALERT"
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def build_corpus(rules, samples_per_disease=20, seed=0):
+    """Returns [{'text', 'label', 'variant'}] in a fixed order for a given seed."""
+    rng = random.Random(seed)
+    # canonical symptom -> alias phrases that normalize back to it
+    aliases = {}
+    for alias, canonical in rules.global_aliases.items():
+        aliases.setdefault(canonical, []).append(alias)
+
+    with open(DATA_PATH, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    corpus = []
+    for row in rows:
+        symptoms = [v.replace("_", " ").strip() for k, v in row.items() if k.startswith("Symptom_") and v and v != "nan"]
+        if not symptoms:
+            continue
+        for _ in range(samples_per_disease):
+            sample = rng.sample(symptoms, rng.randint(1, min(6, len(symptoms))))
+            corpus.append({
+                "text": rng.choice(ENGLISH_PATTERNS).format(", ".join(sample)),
+                "label": row["Disease"],
+                "variant": "english"
+            })
+            if any(s in aliases for s in sample):
+                swapped = [rng.choice(sorted(aliases[s])) if s in aliases else s for s in sample]
+                corpus.append({
+                    "text": rng.choice(HINGLISH_PATTERNS).format(", ".join(swapped)),
+                    "label": row["Disease"],
+                    "variant": "alias"
+                })
+    return corpus
+
+
+def diagnose(rules, classifier, le, text, margin_threshold=None, via_app=False):
+    """
+    One /predict pass. Returns (ranking, rules_ranking, timings_ms, model_ran); rankings
+    are the final diagnosis followed by the remaining allowed diseases in order.
+    via_app runs the model stage through main.get_predicted_value (batcher + cache).
+    """
+    timings = {}
+    start = time.perf_counter()
+    analysis = rules.apply_demographic_context(rules.run_analysis(text))
+    timings["rules"] = 1000 * (time.perf_counter() - start)
+
+    if analysis["emergency"]:
+        return [EMERGENCY], [EMERGENCY], timings, False
+    allowed = analysis.get("allowed_diseases", [])
+    if FALLBACK in allowed:
+        return [FALLBACK], [FALLBACK], timings, False
+
+    predicted = allowed[0]
+    model_ran = classifier is not None and inference.should_run_model(analysis, margin_threshold)
+    if model_ran:
+        start = time.perf_counter()
+        if via_app:
+            raw_prediction = main.get_predicted_value(text)
+        else:
+            class_id = int(classifier.predict([text])[0])
+            raw_prediction = le.inverse_transform([class_id])[0]
+        timings["model"] = 1000 * (time.perf_counter() - start)
+        if raw_prediction in allowed:
+            predicted = raw_prediction
+
+    start = time.perf_counter()
+    main.helper(predicted)
+    timings["helper"] = 1000 * (time.perf_counter() - start)
+    return [predicted] + [d for d in allowed if d != predicted], list(allowed), timings, model_ran
+
+
+def latency_summary(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values)
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p90": round(float(np.percentile(values, 90)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "max": round(float(values.max()), 4)
+    }
+
+
+def accuracy(results):
+    n = len(results)
+    return {
+        "n": n,
+        "top1": round(sum(r[0][:1] == [r[1]] for r in results) / n, 4) if n else None,
+        "top2": round(sum(r[1] in r[0][:2] for r in results) / n, 4) if n else None
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_comparison(report, baseline):
+    """Prints headline metrics next to an earlier report."""
+    def pick(r, *path):
+        for key in path:
+            r = r.get(key) if isinstance(r, dict) else None
+        return r
+
+    rows = [("Total p50 (ms)", ("latency_ms", "total", "p50")), ("Total p99 (ms)", ("latency_ms", "total", "p99")),
+            ("Model p50 (ms)", ("latency_ms", "model", "p50")), ("Throughput (/s)", ("throughput_per_s",)),
+            ("Peak RSS (MB)", ("memory_mb", "peak_rss")), ("Top-1", ("accuracy", "overall", "top1")),
+            ("Top-2", ("accuracy", "overall", "top2"))]
+    print(f"📊 Compared with {baseline['meta'].get('git_commit')} ({baseline['meta'].get('backend')})")
+    for label, path in rows:
+        old, new = pick(baseline, *path), pick(report, *path)
+        change = f"{(new - old) / old * 100:+.1f}%" if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old else ""
+        print(f"   {label:<17} {str(old):>10} -> {str(new):<10} {change}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark latency and accuracy of the diagnosis pipeline.")
+    parser.add_argument("--backend", default=os.environ.get("INFERENCE_BACKEND", "torch"), help="torch, onnx, linear or none")
+    parser.add_argument("--samples", type=int, default=20, help="texts per disease (plus alias variants)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed passes before measuring")
+    parser.add_argument("--skip-margin", type=float, default=None, help="INFERENCE_SKIP_MARGIN to apply")
+    parser.add_argument("--via-app", action="store_true",
+                        help="model stage through main.get_predicted_value (MicroBatcher + prediction_cache)")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "benchmark_report.json"))
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+    if args.via_app and args.backend != main.INFERENCE_BACKEND:
+        parser.error(f"--via-app uses the app's INFERENCE_BACKEND ({main.INFERENCE_BACKEND}); set it instead of --backend")
+
+    rss_start = peak_rss_mb()
+    # Cache off: repeated texts would otherwise measure the LRU, not the engine
+    rules = RulesEngine(cache_size=0)
+    classifier = None
+    if args.via_app:
+        classifier = main.classifier.get()
+    elif args.backend != "none":
+        classifier = inference.load_classifier(
+            args.backend, main.MODEL_PATH, onnx_path=os.environ.get("ONNX_MODEL_PATH"), linear_path=main.LINEAR_MODEL_PATH
+        )
+    le = main.le.get()
+    if classifier is not None and le is None:
+        print("⚠️ Label encoder missing, benchmarking rules only.")
+        classifier = None
+    rss_loaded = peak_rss_mb()
+
+    corpus = build_corpus(rules, args.samples, args.seed)
+    print(f"🔄 {len(corpus)} texts, backend {classifier.name if classifier else 'none (rules only)'}")
+    for item in corpus[:args.warmup]:
+        diagnose(rules, classifier, le, item["text"], args.skip_margin, args.via_app)
+
+    stages = {"rules": [], "model": [], "helper": [], "total": []}
+    results, rules_results, by_variant = [], [], {}
+    model_runs = 0
+    outcomes = {"emergency": 0, "fallback": 0, "diagnosis": 0}
+    wall_start = time.perf_counter()
+    for item in corpus:
+        ranking, rules_ranking, timings, model_ran = diagnose(rules, classifier, le, item["text"], args.skip_margin, args.via_app)
+        for stage, ms in timings.items():
+            stages[stage].append(ms)
+        stages["total"].append(sum(timings.values()))
+        model_runs += model_ran
+        outcomes["emergency" if ranking == [EMERGENCY] else "fallback" if ranking == [FALLBACK] else "diagnosis"] += 1
+        results.append((ranking, item["label"]))
+        rules_results.append((rules_ranking, item["label"]))
+        by_variant.setdefault(item["variant"], []).append((ranking, item["label"]))
+    wall = time.perf_counter() - wall_start
+
+    covered = set(rules.disease_rules)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": classifier.name if classifier else "none",
+            "skip_margin": args.skip_margin,
+            "via_app": args.via_app,
+            "corpus": {"texts": len(corpus), "samples_per_disease": args.samples, "seed": args.seed,
+                       "variants": {k: len(v) for k, v in by_variant.items()}}
+        },
+        "latency_ms": {stage: latency_summary(values) for stage, values in stages.items()},
+        "throughput_per_s": round(len(corpus) / wall, 1),
+        "memory_mb": {"start_rss": rss_start, "after_load_rss": rss_loaded, "peak_rss": peak_rss_mb()},
+        "accuracy": {
+            "overall": accuracy(results),
+            "rules_only": accuracy(rules_results),
+            "by_variant": {k: accuracy(v) for k, v in by_variant.items()},
+            # Diseases without a rule can only ever get the General Physician fallback
+            "labels_with_rules": accuracy([r for r in results if r[1] in covered])
+        },
+        "model": {"runs": model_runs, "skipped": outcomes["diagnosis"] - model_runs},
+        "outcomes": outcomes
+    }
+    if args.via_app:
+        report["prediction_cache"] = main.prediction_cache.stats()
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    total, acc = report["latency_ms"]["total"], report["accuracy"]
+    print(f"   Total latency:    p50 {total['p50']:.3f} ms, p90 {total['p90']:.3f} ms, p99 {total['p99']:.3f} ms")
+    for stage in ("rules", "model", "helper"):
+        s = report["latency_ms"][stage]
+        if s["count"]:
+            print(f"   {stage.capitalize():<17} p50 {s['p50']:.3f} ms, p99 {s['p99']:.3f} ms ({s['count']} calls)")
+    print(f"   Throughput:       {report['throughput_per_s']} texts/s")
+    print(f"   Peak RSS:         {report['memory_mb']['peak_rss']} MB")
+    print(f"   Top-1 / Top-2:    {acc['overall']['top1'] * 100:.1f}% / {acc['overall']['top2'] * 100:.1f}% "
+          f"(rules only {acc['rules_only']['top1'] * 100:.1f}% / {acc['rules_only']['top2'] * 100:.1f}%)")
+    for variant, v in acc["by_variant"].items():
+        print(f"   {variant:<17} top-1 {v['top1'] * 100:.1f}% ({v['n']} texts)")
+    covered_acc = acc["labels_with_rules"]
+    if covered_acc["n"]:
+        print(f"   With a rule:      top-1 {covered_acc['top1'] * 100:.1f}% ({covered_acc['n']} texts whose disease has a rule)")
+    print(f"   Outcomes:         {report['outcomes']}, model skipped {report['model']['skipped']}x")
+    print(f"✅ Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main_cli()
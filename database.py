@@ -1,14 +1,20 @@
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
+from psycopg2.pool import PoolError
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
-def get_db_connection():
+def _connect():
     """
-    Returns a new PostgreSQL connection to the Supabase database.
+    Opens a brand new PostgreSQL connection to the Supabase database.
     Uses DATABASE_URL (standard for Render/Supabase) or individual env vars.
     """
     database_url = os.environ.get('DATABASE_URL')
-    
+
     if database_url:
         # Supabase/Render provides a full connection URL
         return psycopg2.connect(database_url)
@@ -22,6 +28,216 @@ def get_db_connection():
             port=int(os.environ.get('DB_PORT', 5432))
         )
 
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled psycopg2 connection.
+    close() hands the connection back to the pool instead of closing the socket;
+    everything else is delegated. A proxy garbage-collected without close() only
+    queues its connection for the pool to reclaim (see ConnectionPool.getconn).
+    """
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # e.g. conn.autocommit = True must reach the real connection
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn, self._created_at)
+
+    def __del__(self):
+        # Routes that raise before conn.close() must not leak a pool slot. The cyclic GC
+        # can run this on a thread that already holds the pool's lock, so no locks and
+        # no network I/O here: deque.append is atomic, getconn() does the rollback later.
+        if self._conn is not None:
+            self._pool._orphans.append((self._conn, self._created_at))
+            self._conn = None
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections for one worker process.
+
+    - At most `maxconn` connections exist (checked out + idle); callers wait up to
+      `timeout` seconds for a free one, then get PoolError.
+    - Connections older than `max_lifetime` seconds are replaced.
+    - Connections idle for more than `healthcheck_after` seconds are pinged
+      (SELECT 1) before being handed out; dead ones are replaced.
+    - Returned connections are rolled back if a transaction was left open.
+    - Connections whose proxy was garbage-collected without close() are reclaimed
+      at the start of the next getconn() (and by stats() / close_all()).
+    """
+    def __init__(self, maxconn=4, timeout=10.0, max_lifetime=1800.0, healthcheck_after=30.0, connect=_connect):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_after = healthcheck_after
+        self._connect = connect
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = deque()  # (conn, created_at, returned_at), most recent on the right
+        self._orphans = deque()  # (conn, created_at) from PooledConnection.__del__, still holding a slot
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def getconn(self):
+        self._reclaim_orphans()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"no database connection available within {self.timeout}s (pool size {self.maxconn})")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    return PooledConnection(self, self._connect(), time.monotonic())
+
+                conn, created_at, returned_at = entry
+                now = time.monotonic()
+                if conn.closed or now - created_at > self.max_lifetime:
+                    self._discard(conn)
+                    continue
+                if now - returned_at > self.healthcheck_after and not self._is_alive(conn):
+                    self._discard(conn)
+                    continue
+                return PooledConnection(self, conn, created_at)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, created_at):
+        try:
+            if self._closed or conn.closed:
+                self._discard(conn)
+                return
+            # Never hand out a connection with a half-finished transaction
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self._discard(conn)
+                    return
+            if conn.autocommit:
+                conn.autocommit = False
+            with self._lock:
+                self._idle.append((conn, created_at, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Closes idle connections; checked-out ones are closed when returned."""
+        self._closed = True
+        self._reclaim_orphans()
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        self._reclaim_orphans()
+        with self._lock:
+            return {"maxconn": self.maxconn, "idle": len(self._idle)}
+
+    def _reclaim_orphans(self):
+        while True:
+            try:
+                conn, created_at = self._orphans.popleft()
+            except IndexError:
+                return
+            self.release(conn, created_at)
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns this process's pool, creating it on first use.
+    Recreated after fork so gunicorn workers never share sockets.
+    Size: DB_POOL_SIZE (default 4 = 2 gunicorn threads + headroom for background work).
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    maxconn=int(os.environ.get('DB_POOL_SIZE', 4)),
+                    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                    max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+                    healthcheck_after=float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', 30))
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def get_db_connection():
+    """
+    Returns a pooled PostgreSQL connection.
+    conn.close() returns it to the pool (existing call sites need no changes).
+    """
+    return get_pool().getconn()
+
+@contextmanager
+def connection():
+    """
+    Context-manager API: always returns the connection to the pool.
+
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            ...
+            conn.commit()
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
 def get_dict_cursor(conn):
     """Returns a cursor that returns rows as dictionaries."""
     return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+def json_param(value):
+    """Wraps a dict/list so psycopg2 sends it as a JSON(B) parameter."""
+    return psycopg2.extras.Json(value)
+
+def execute_values(cursor, sql, rows, page_size=100, template=None):
+    """
+    Multi-row statement in one round trip: `sql` contains a single VALUES %s
+    placeholder, e.g. "INSERT INTO t (a, b) VALUES %s".
+    """
+    psycopg2.extras.execute_values(cursor, sql, rows, template=template, page_size=page_size)
@@ -0,0 +1,112 @@
+"""
+Exports medical_bert_model to ONNX with dynamic int8 quantization and checks
+its outputs against the PyTorch model.
+
+    python export_onnx.py                  # writes medical_bert_model/model.int8.onnx
+    python export_onnx.py --check-only     # parity check of an existing export
+
+Then run the app with INFERENCE_BACKEND=onnx (only onnxruntime + tokenizers are needed
+at runtime, see requirements_onnx.txt). Requires torch, transformers, onnx and onnxruntime.
+"""
+import argparse
+import inspect
+import os
+import random
+import sys
+import csv
+
+import inference
+
+DATA_PATH = "symptoms_df_clean.csv"
+
+
+def parity_texts(n, seed=0):
+    """Deterministic symptom sentences in the same style as train_model.py."""
+    rng = random.Random(seed)
+    with open(DATA_PATH, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    patterns = ["I have {}", "Experiencing {}", "My symptoms are {}", "{}", "I feel {}"]
+    texts = []
+    while len(texts) < n:
+        row = rng.choice(rows)
+        symptoms = [v.replace("_", " ").strip() for k, v in row.items() if k.startswith("Symptom_") and v and v != "nan"]
+        if symptoms:
+            sample = rng.sample(symptoms, rng.randint(1, min(6, len(symptoms))))
+            texts.append(rng.choice(patterns).format(", ".join(sample)))
+    return texts
+
+
+def export(model_path, fp32_path, int8_path):
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    model.eval()
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    sample = tokenizer(["I have fever, cough"], return_tensors="pt")
+    # Newer torch defaults to the dynamo exporter; the TorchScript one gives a graph
+    # onnxruntime's quantizer handles reliably
+    extra = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    print(f"🔄 Exporting {model_path} -> {fp32_path}")
+    torch.onnx.export(
+        LogitsOnly(model),
+        (sample["input_ids"], sample["attention_mask"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"}
+        },
+        opset_version=17,
+        **extra
+    )
+
+    print(f"🔄 Quantizing (dynamic int8) -> {int8_path}")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    for path in (fp32_path, int8_path):
+        print(f"   {os.path.basename(path)}: {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export medical_bert_model to int8 ONNX and verify parity.")
+    parser.add_argument("--model-path", default=os.environ.get("MODEL_PATH", "medical_bert_model"))
+    parser.add_argument("--output", default=None, help=f"int8 model path (default <model-path>/{inference.ONNX_FILENAME})")
+    parser.add_argument("--check-only", action="store_true", help="skip export, only run the parity check")
+    parser.add_argument("--samples", type=int, default=500, help="texts used for the parity check")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="fail below this top-1 agreement")
+    args = parser.parse_args()
+
+    int8_path = args.output or os.path.join(args.model_path, inference.ONNX_FILENAME)
+    fp32_path = int8_path.replace(".int8.onnx", ".onnx") if int8_path.endswith(".int8.onnx") else int8_path + ".fp32.onnx"
+
+    if not args.check_only:
+        export(args.model_path, fp32_path, int8_path)
+
+    print(f"🔄 Parity check on {args.samples} texts (PyTorch vs ONNX int8)")
+    reference = inference.TorchClassifier(args.model_path)
+    candidate = inference.OnnxClassifier(int8_path, args.model_path)
+    report = inference.compare_backends(reference, candidate, parity_texts(args.samples))
+    print(f"   Top-1 agreement:   {report['agreement'] * 100:.2f}%")
+    print(f"   Max |logit diff|:  {report['max_abs_diff']:.4f} (mean {report['mean_abs_diff']:.4f})")
+    print(f"   Latency per text:  torch {report['reference_ms']:.2f} ms, onnx {report['candidate_ms']:.2f} ms")
+
+    if report["agreement"] < args.min_agreement:
+        print(f"❌ Agreement below {args.min_agreement * 100:.1f}%, don't deploy this export.")
+        sys.exit(1)
+    print("✅ ONNX model matches PyTorch. Set INFERENCE_BACKEND=onnx to use it.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# gazetteer.py
+# Offline city / pincode centroids used by utils.geocode_address when Nominatim
+# is slow or unreachable. Built once from bundled CSVs; lookups never touch the network.
+
+import csv
+import os
+import re
+
+CITIES_CSV = "gazetteer_cities.csv"
+
+
+def _normalize_name(value):
+    """'Bengaluru ', 'BENGALURU.' and 'bengaluru city' all map to 'bengaluru'."""
+    name = " ".join(re.sub(r"[^a-z\s]", " ", str(value or "").lower()).split())
+    if name.endswith(" city") and len(name) > 5:
+        name = name[:-5]
+    return name
+
+
+def _normalize_pincode(value):
+    digits = re.sub(r"\D", "", str(value or ""))
+    return digits if len(digits) == 6 else None
+
+
+class Gazetteer:
+    """
+    City and pincode centroids for India.
+
+    - gazetteer_cities.csv (bundled): city, '|'-separated aliases, state,
+      3-digit pincode prefix and centroid.
+    - An optional full pincode table (CSV with pincode, lat, lng columns, e.g. the
+      India Post directory) can be supplied via `pincodes_path` for exact matches.
+
+    lookup() prefers an exact pincode, then the city name, then the pincode prefix.
+    """
+    def __init__(self, data_dir, pincodes_path=None):
+        self._cities = {}
+        self._prefixes = {}
+        self._pincodes = {}
+
+        with open(os.path.join(data_dir, CITIES_CSV), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                coords = (float(row["lat"]), float(row["lng"]))
+                for name in [row["city"]] + row["aliases"].split("|"):
+                    if name:
+                        self._cities.setdefault(_normalize_name(name), coords)
+                # Several cities share a prefix; the first (largest) listed wins
+                self._prefixes.setdefault(row["pin_prefix"], coords)
+
+        if pincodes_path and os.path.exists(pincodes_path):
+            with open(pincodes_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    pincode = _normalize_pincode(row.get("pincode"))
+                    try:
+                        coords = (float(row["lat"]), float(row["lng"]))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if pincode:
+                        self._pincodes.setdefault(pincode, coords)
+
+    def lookup(self, city=None, pincode=None):
+        """Returns (lat, lng) or (None, None)."""
+        pincode = _normalize_pincode(pincode)
+        if pincode and pincode in self._pincodes:
+            return self._pincodes[pincode]
+
+        coords = self._cities.get(_normalize_name(city))
+        if coords:
+            return coords
+
+        if pincode and pincode[:3] in self._prefixes:
+            return self._prefixes[pincode[:3]]
+        return None, None
+
+    def __len__(self):
+        return len(self._cities) + len(self._pincodes)
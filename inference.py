@@ -0,0 +1,572 @@
+# inference.py
+# Disease classifier backends used by main.get_predicted_value.
+#
+#   INFERENCE_BACKEND=torch (default)  medical_bert_model through PyTorch + transformers
+#   INFERENCE_BACKEND=onnx             int8 ONNX export of the same model through onnxruntime
+#                                      (create it with export_onnx.py); never imports torch
+#   INFERENCE_BACKEND=linear           hashed n-gram TF-IDF + linear model distilled from the
+#                                      BERT model (train_linear.py); needs only scikit-learn
+#
+# Both backends take a list of texts and return class ids / logits as NumPy arrays;
+# the label encoder stays in main.py. MicroBatcher wraps either one to batch
+# concurrent requests; PredictionCache remembers results for repeated inputs.
+
+import hashlib
+import math
+import os
+import pickle
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+from rules_engine import LRUCache
+
+MAX_LENGTH = 128  # Same truncation as training / the original get_predicted_value
+ONNX_FILENAME = "model.int8.onnx"
+LINEAR_FILENAME = "linear_model.pkl"
+WHITESPACE_RE = re.compile(r"[ \t\n\r]+")  # What the BERT tokenizer and LinearClassifier split on
+
+
+def length_buckets(lengths, max_batch=32, max_ratio=2.0, slack=8):
+    """
+    Groups indices of similar sequence length so each group is padded only to its
+    own longest member. Indices are taken shortest first; a new group starts when
+    the current one is full or the next sequence is more than `max_ratio` times
+    (and `slack` tokens) longer than the group's shortest.
+    """
+    buckets = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if buckets and len(buckets[-1]) < max_batch:
+            first = lengths[buckets[-1][0]]
+            if lengths[i] <= max(first * max_ratio, first + slack):
+                buckets[-1].append(i)
+                continue
+        buckets.append([i])
+    return buckets
+
+
+def _pad(rows, pad_id):
+    """Right-pads token id lists to the longest one; returns (ids, attention_mask)."""
+    width = max(len(row) for row in rows)
+    ids = np.full((len(rows), width), pad_id, dtype=np.int64)
+    mask = np.zeros((len(rows), width), dtype=np.int64)
+    for r, row in enumerate(rows):
+        ids[r, :len(row)] = row
+        mask[r, :len(row)] = 1
+    return ids, mask
+
+
+class TorchClassifier:
+    """DistilBERT sequence classifier on PyTorch (CUDA if available)."""
+    name = "torch"
+
+    def __init__(self, model_path):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model.to(self.device)
+        self.model.eval()
+
+    def predict_logits(self, texts):
+        encodings = self.tokenizer(list(texts), truncation=True, max_length=MAX_LENGTH)
+        logits = None
+        # Batches of mixed lengths run as length buckets, each padded to its own max
+        for bucket in length_buckets([len(ids) for ids in encodings["input_ids"]]):
+            inputs = self.tokenizer.pad(
+                {k: [v[i] for i in bucket] for k, v in encodings.items()},
+                return_tensors="pt"
+            )
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            with self._torch.no_grad():
+                bucket_logits = self.model(**inputs).logits.float().cpu().numpy()
+            if logits is None:
+                logits = np.empty((len(texts), bucket_logits.shape[-1]), dtype=np.float32)
+            logits[bucket] = bucket_logits
+        return logits
+
+    def predict(self, texts):
+        return np.argmax(self.predict_logits(texts), axis=-1)
+
+
+class OnnxClassifier:
+    """
+    The same classifier exported to ONNX, run by onnxruntime on CPU.
+    Tokenization uses the `tokenizers` package and the saved tokenizer.json,
+    so neither torch nor transformers is imported.
+    """
+    name = "onnx"
+
+    def __init__(self, onnx_path, tokenizer_path, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(tokenizer_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_LENGTH)
+        # Padding is done per length bucket in predict_logits()
+        self.tokenizer.no_padding()
+        self.pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def predict_logits(self, texts):
+        rows = [e.ids for e in self.tokenizer.encode_batch(list(texts))]
+        logits = None
+        for bucket in length_buckets([len(row) for row in rows]):
+            ids, mask = _pad([rows[i] for i in bucket], self.pad_id)
+            feeds = {k: v for k, v in {"input_ids": ids, "attention_mask": mask}.items() if k in self._input_names}
+            bucket_logits = self.session.run(None, feeds)[0]
+            if logits is None:
+                logits = np.empty((len(texts), bucket_logits.shape[-1]), dtype=np.float32)
+            logits[bucket] = bucket_logits
+        return logits
+
+    def predict(self, texts):
+        return np.argmax(self.predict_logits(texts), axis=-1)
+
+
+class LinearClassifier:
+    """
+    Linear model over hashed word n-grams with sublinear TF-IDF (see train_linear.py).
+    The artifact holds only the hash buckets seen in training, their idf and weight
+    rows, so scoring a text is a few murmurhash calls and a small dot product:
+    microseconds on CPU, and only scikit-learn's murmurhash is needed.
+    Scores stand in for logits; class ids are the label encoder's, like the BERT model's.
+    """
+    name = "linear"
+    wants_batching = False  # Faster than a MicroBatcher thread hop
+    TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")  # HashingVectorizer's default token_pattern
+
+    def __init__(self, path):
+        from sklearn.utils import murmurhash3_32
+
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        self._hash = murmurhash3_32
+        self.n_features = artifact["n_features"]
+        self.ngram_range = tuple(artifact["ngram_range"])
+        self.default_idf = float(artifact["default_idf"])
+        self.idf = np.asarray(artifact["idf"], dtype=np.float64).tolist()  # Python floats: faster per token
+        self.coef = np.asarray(artifact["coef"], dtype=np.float64)
+        self.num_labels = artifact["num_labels"]
+        self.metadata = artifact.get("metadata", {})
+        self._rows = {int(f): r for r, f in enumerate(artifact["features"])}
+        # Columns of coef -> label encoder ids; classes never seen in training stay at -inf
+        self._bias = np.full(self.num_labels, -np.inf)
+        self._columns = np.asarray(artifact["classes"], dtype=np.int64)
+        self._bias[self._columns] = artifact["intercept"]
+
+    def _ngrams(self, text):
+        tokens = self.TOKEN_RE.findall(text.lower())
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(tokens) - n + 1):
+                yield " ".join(tokens[i:i + n])
+
+    def _score(self, text):
+        counts = {}
+        for gram in self._ngrams(text):
+            index = abs(self._hash(gram, seed=0)) % self.n_features
+            counts[index] = counts.get(index, 0) + 1
+
+        rows, values, norm = [], [], 0.0
+        for index, count in counts.items():
+            row = self._rows.get(index)
+            value = (1.0 + math.log(count)) * (self.idf[row] if row is not None else self.default_idf)
+            norm += value * value
+            if row is not None:
+                rows.append(row)
+                values.append(value)
+
+        logits = self._bias.copy()
+        if rows:
+            logits[self._columns] += np.dot(values, self.coef[rows]) / math.sqrt(norm)
+        return logits
+
+    def predict_logits(self, texts):
+        return np.stack([self._score(str(text)) for text in texts]).astype(np.float32)
+
+    def predict(self, texts):
+        return np.argmax(self.predict_logits(texts), axis=-1)
+
+
+class MicroBatcher:
+    """
+    Wraps a classifier so concurrent predict() calls share one forward pass.
+    A worker thread takes the first pending text, keeps collecting for up to
+    `max_wait` seconds or `max_batch` texts, runs them as one padded batch and
+    hands each caller its row through a Future. Errors reach every caller in the batch.
+    When only one caller is active there is nothing to wait for, so a lone request
+    runs immediately. Same predict()/predict_logits() interface as the wrapped classifier.
+    """
+    def __init__(self, classifier, max_batch=16, max_wait=0.005, timeout=30.0):
+        self.classifier = classifier
+        self.name = f"{classifier.name}+batching"
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.batches = 0
+        self.items = 0
+        self._active = 0  # callers inside predict_logits()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._queue = None
+
+    def submit(self, text):
+        """Queues one text; the Future resolves to its logits row."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def predict_logits(self, texts):
+        with self._lock:
+            self._active += 1
+        try:
+            futures = [self.submit(text) for text in texts]
+            return np.stack([future.result(timeout=self.timeout) for future in futures])
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def predict(self, texts):
+        return np.argmax(self.predict_logits(texts), axis=-1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch": self.items / self.batches if self.batches else 0.0
+            }
+
+    def _ensure_started(self):
+        # (Re)start lazily: threads don't survive a gunicorn fork
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Other callers in flight: give their texts up to max_wait to arrive
+            deadline = time.monotonic() + (self.max_wait if self._active > 1 else 0.0)
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                logits = self.classifier.predict_logits([text for text, _ in batch])
+                for (_, future), row in zip(batch, logits):
+                    future.set_result(row)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+
+
+class LazyResource:
+    """
+    Loads an expensive object on first get() (or in warm_up()'s background thread)
+    instead of at import time. Concurrent callers wait for the single load; a loader
+    that raises or returns None marks the resource 'unavailable' and get() returns None.
+    """
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self._state = "not_loaded"  # not_loaded -> loading -> ready / unavailable
+        self._error = None
+        self._load_seconds = None
+        # A load in progress during a fork (gunicorn --preload) never finishes in the child
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._state == "loading":
+            self._state = "not_loaded"
+
+    def get(self):
+        if self._state in ("ready", "unavailable"):
+            return self._value
+        with self._lock:
+            if self._state not in ("ready", "unavailable"):
+                self._state = "loading"
+                start = time.perf_counter()
+                try:
+                    self._value = self._loader()
+                except Exception as e:
+                    print(f"{self.name} not loaded: {e}")
+                    self._value, self._error = None, str(e)
+                self._load_seconds = round(time.perf_counter() - start, 3)
+                self._state = "ready" if self._value is not None else "unavailable"
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._state in ("ready", "unavailable")
+
+    def status(self):
+        status = {"state": self._state, "load_seconds": self._load_seconds}
+        if self._error:
+            status["error"] = self._error
+        return status
+
+
+def warm_up(resources):
+    """Loads resources one after another in a daemon thread; returns the thread."""
+    def run():
+        for resource in resources:
+            resource.get()
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def canonical_text(text):
+    """
+    Cache key for a prediction input. Only folds what no backend can see: case
+    (the tokenizer is uncased, LinearClassifier lowercases) and runs of spaces /
+    tabs / newlines (both split on them). Punctuation and synonyms stay as typed,
+    because the model scores them, so "stomach ache" and "stomach pain" keep
+    separate entries.
+    """
+    return WHITESPACE_RE.sub(" ", str(text).lower()).strip(" ")
+
+
+def model_fingerprint(*paths):
+    """
+    Short hash of the names, sizes and mtimes of the given model files / directories
+    (e.g. model dir, ONNX file, label encoder); changes when any of them is replaced.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        if not path:
+            continue
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)};".encode())
+        elif os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                stat = os.stat(os.path.join(path, name))
+                digest.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)};".encode())
+        digest.update(b"|")
+    return digest.hexdigest()[:12]
+
+
+class PredictionCache:
+    """
+    Maps canonical input text -> (label, logits) for one model.
+    - In-process LRU (`maxsize` entries, per gunicorn worker).
+    - Optional SQLite file at `path` shared by all workers on the machine; entries
+      are looked up there on an in-memory miss and kept to `disk_maxsize` rows.
+    `namespace` (backend + model fingerprint) keeps results of different models apart.
+    Each entry remembers how long the model took, so stats() can report time saved.
+    """
+    def __init__(self, maxsize=2048, path=None, namespace="", disk_maxsize=50000):
+        self.namespace = namespace
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self.disk_hits = 0
+        self.seconds_saved = 0.0
+        self._memory = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        if path:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS predictions ("
+                    "key TEXT PRIMARY KEY, label TEXT NOT NULL, logits BLOB NOT NULL, seconds REAL NOT NULL)"
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Prediction disk cache disabled: {e}")
+                self.path = None
+
+    @property
+    def enabled(self):
+        return self._memory.maxsize > 0 or bool(self.path)
+
+    def get(self, text):
+        """Returns (label, logits) or None."""
+        key = f"{self.namespace}:{text}"
+        entry = self._memory.get(key)
+        if entry is None and self.path:
+            entry = self._disk_get(key)
+            if entry is not None:
+                self._memory.put(key, entry)
+                with self._lock:
+                    self.disk_hits += 1
+        if entry is None:
+            return None
+        with self._lock:
+            self.seconds_saved += entry[2]
+        return entry[0], entry[1]
+
+    def put(self, text, label, logits, seconds):
+        key = f"{self.namespace}:{text}"
+        entry = (label, np.asarray(logits, dtype=np.float32), float(seconds))
+        self._memory.put(key, entry)
+        if self.path:
+            self._disk_put(key, entry)
+
+    def stats(self):
+        stats = self._memory.stats()
+        with self._lock:
+            # Memory misses answered from disk are hits of the cache as a whole
+            hits = stats["hits"] + self.disk_hits
+            total = stats["hits"] + stats["misses"]
+            stats.update({
+                "disk_hits": self.disk_hits,
+                "disk": bool(self.path),
+                "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "seconds_saved": round(self.seconds_saved, 3)
+            })
+        return stats
+
+    def _connection(self):
+        # One connection per thread and process (sqlite3 connections aren't shared)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _disk_get(self, key):
+        try:
+            row = self._connection().execute(
+                "SELECT label, logits, seconds FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Prediction cache read error: {e}")
+            return None
+        if row is None:
+            return None
+        return row[0], np.frombuffer(row[1], dtype=np.float32), row[2]
+
+    def _disk_put(self, key, entry):
+        label, logits, seconds = entry
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, label, logits, seconds) VALUES (?, ?, ?, ?)",
+                (key, label, logits.tobytes(), seconds)
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % 500 == 0
+            if prune:
+                # Oldest rows (lowest rowid) go first
+                conn.execute(
+                    "DELETE FROM predictions WHERE rowid <= (SELECT MAX(rowid) FROM predictions) - ?",
+                    (self.disk_maxsize,)
+                )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Prediction cache write error: {e}")
+
+
+def should_run_model(analysis, margin_threshold=None):
+    """
+    Decides whether the classifier can still change a rules-engine outcome.
+    /predict only accepts a model prediction that is one of analysis['allowed_diseases'],
+    so with a single allowed disease the answer is already fixed. With
+    `margin_threshold` set, a top candidate leading the runner-up by at least
+    that score is also accepted without the model.
+    """
+    if len(analysis.get('allowed_diseases', [])) < 2:
+        return False
+    margin = analysis.get('score_margin')
+    if margin_threshold is not None and margin is not None and margin >= margin_threshold:
+        return False
+    return True
+
+
+def load_classifier(backend, model_path, onnx_path=None, threads=None, linear_path=None):
+    """
+    Builds the configured backend, or returns None (rules-only mode) if its
+    dependencies or model files are missing.
+    """
+    backend = (backend or "torch").lower()
+    try:
+        if backend == "onnx":
+            onnx_path = onnx_path or os.path.join(model_path, ONNX_FILENAME)
+            classifier = OnnxClassifier(onnx_path, model_path, threads=threads)
+        elif backend == "linear":
+            classifier = LinearClassifier(linear_path or LINEAR_FILENAME)
+        elif backend == "torch":
+            classifier = TorchClassifier(model_path)
+        else:
+            print(f"Unknown INFERENCE_BACKEND '{backend}'. ML predictions disabled.")
+            return None
+    except ImportError as e:
+        print(f"{backend} backend dependencies not installed ({e}). ML predictions disabled. Rules-based diagnosis will work.")
+        return None
+    except Exception as e:
+        print(f"ML model not loaded (optional): {e}")
+        return None
+
+    print(f"Medical model loaded successfully ({classifier.name}).")
+    return classifier
+
+
+def compare_backends(reference, candidate, texts, batch_size=32):
+    """
+    Output parity check between two classifiers on the same texts.
+    Returns agreement of predicted classes, max / mean absolute logit difference
+    and per-text latency (ms) of each backend.
+    """
+    ref_logits, cand_logits = [], []
+    ref_time = cand_time = 0.0
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        start = time.perf_counter()
+        ref_logits.append(reference.predict_logits(batch))
+        ref_time += time.perf_counter() - start
+        start = time.perf_counter()
+        cand_logits.append(candidate.predict_logits(batch))
+        cand_time += time.perf_counter() - start
+
+    ref_logits = np.concatenate(ref_logits)
+    cand_logits = np.concatenate(cand_logits)
+    diff = np.abs(ref_logits - cand_logits)
+    return {
+        "texts": len(texts),
+        "agreement": float(np.mean(ref_logits.argmax(-1) == cand_logits.argmax(-1))),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "reference_ms": 1000.0 * ref_time / len(texts),
+        "candidate_ms": 1000.0 * cand_time / len(texts)
+    }
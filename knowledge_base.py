@@ -0,0 +1,104 @@
+# knowledge_base.py
+# Precomputed disease knowledge base (description, precautions, meds, diet, workouts, doctors)
+# Built once at startup from the clean CSVs so helper() is a dict lookup instead of
+# seven pandas boolean-mask scans + ast.literal_eval per prediction.
+
+import ast
+import csv
+import os
+from collections import namedtuple
+
+# Frozen, already-parsed record for one disease (all list fields are tuples)
+DiseaseRecord = namedtuple(
+    "DiseaseRecord",
+    ["description", "precautions", "medications", "diets", "workouts", "doctors"]
+)
+
+EMPTY_RECORD = DiseaseRecord("No description available.", (), (), (), (), ())
+
+PRECAUTION_COLUMNS = ["Precaution_1", "Precaution_2", "Precaution_3", "Precaution_4"]
+
+
+def _read_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def _parse_list_cell(value):
+    """
+    Parses string list representations like "['item1', 'item2']".
+    Anything else (or an unparsable list) is kept as a single item.
+    """
+    if value.startswith("[") and value.endswith("]"):
+        try:
+            parsed = ast.literal_eval(value)
+            if isinstance(parsed, list):
+                return parsed
+        except (ValueError, SyntaxError):
+            pass
+    return [value]
+
+
+class KnowledgeBase:
+    """
+    Maps each disease to a DiseaseRecord. Lookups are O(1); unknown diseases
+    get EMPTY_RECORD. Blank CSV cells are skipped.
+    """
+    def __init__(self, data_dir):
+        descriptions = {}
+        precautions = {}
+        medications = {}
+        diets = {}
+        workouts = {}
+        doctors = {}
+
+        for row in _read_rows(os.path.join(data_dir, "description.csv")):
+            if row["Description"]:
+                descriptions.setdefault(row["Disease"], []).append(row["Description"])
+
+        for row in _read_rows(os.path.join(data_dir, "precautions_clean.csv")):
+            # Only the first precaution row per disease is used by the app
+            if row["Disease"] not in precautions:
+                precautions[row["Disease"]] = [row[col] for col in PRECAUTION_COLUMNS if row.get(col)]
+
+        for row in _read_rows(os.path.join(data_dir, "medications_clean.csv")):
+            if row["Medication"]:
+                medications.setdefault(row["Disease"], []).extend(_parse_list_cell(row["Medication"]))
+
+        for row in _read_rows(os.path.join(data_dir, "diet_clean.csv")):
+            if row["Diet"]:
+                diets.setdefault(row["Disease"], []).extend(_parse_list_cell(row["Diet"]))
+
+        # NOTE: workout CSV uses lowercase column names
+        for row in _read_rows(os.path.join(data_dir, "workout_clean.csv")):
+            if row["workout"]:
+                workouts.setdefault(row["disease"], []).append(row["workout"])
+
+        for row in _read_rows(os.path.join(data_dir, "doctor_specialization_clean.csv")):
+            if row["Doctor"]:
+                doctors.setdefault(row["Disease"], []).append(row["Doctor"])
+
+        names = set(descriptions) | set(precautions) | set(medications) | set(diets) | set(workouts) | set(doctors)
+        self._records = {
+            name: DiseaseRecord(
+                description=" ".join(descriptions[name]) if name in descriptions else EMPTY_RECORD.description,
+                precautions=tuple(precautions.get(name, ())),
+                medications=tuple(medications.get(name, ())),
+                diets=tuple(diets.get(name, ())),
+                workouts=tuple(workouts.get(name, ())),
+                doctors=tuple(doctors.get(name, ()))
+            )
+            for name in names
+        }
+
+    def get(self, disease):
+        return self._records.get(disease, EMPTY_RECORD)
+
+    def __contains__(self, disease):
+        return disease in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def diseases(self):
+        return sorted(self._records)
@@ -1,6 +1,4 @@
 from flask import Flask, request, render_template, jsonify, redirect, url_for, session, flash, send_from_directory
-import numpy as np
-import pandas as pd
 import pickle
 import os
 from dotenv import load_dotenv
@@ -8,21 +6,15 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import ast
+import threading
+from time import monotonic
 from authlib.integrations.flask_client import OAuth
 
-# Optional ML imports (not required for rules-based diagnosis)
-try:
-    import torch
-    from transformers import AutoTokenizer, AutoModelForSequenceClassification
-    ML_AVAILABLE = True
-except ImportError:
-    print("PyTorch/transformers not installed. ML predictions disabled. Rules-based diagnosis will work.")
-    torch = None
-    ML_AVAILABLE = False
-
 import database  # our PostgreSQL connection helper
 import utils     # Telemedicine utilities
+import inference  # Optional ML backends (torch / onnx); not required for rules-based diagnosis
 from rules_engine import RulesEngine
+from knowledge_base import KnowledgeBase
 import followup_questions  # UX Feature: Follow-up questions for clarification
 
 # Load environment variables from .env file (if exists)
@@ -71,146 +63,152 @@ google = oauth.register(
     client_kwargs={'scope': 'openid email profile'}
 )
 
-# Initialize Rules Engine
-rules_engine = RulesEngine()
+# ==========================================
+# Heavy resources load lazily (first use or background warm-up), so the worker can serve
+# login / dashboards / booking right after boot. /ready reports what is loaded.
+# ==========================================
+
+# Rules Engine (RULES_CACHE_SIZE bounds the per-worker analysis LRU cache)
+rules_engine = inference.LazyResource(
+    "rules_engine", lambda: RulesEngine(cache_size=int(os.environ.get('RULES_CACHE_SIZE', 1024)))
+)
 
 # ==========================================
-# Load datasets
+# Load disease knowledge base (description, precautions, meds, diet, workout, doctor)
 # ==========================================
-sym_des = pd.read_csv(os.path.join(basedir, "symptoms_df_clean.csv"))
-precautions = pd.read_csv(os.path.join(basedir, "precautions_clean.csv"))
-workout = pd.read_csv(os.path.join(basedir, "workout_clean.csv"))
-description = pd.read_csv(os.path.join(basedir, "description.csv"))
-medications = pd.read_csv(os.path.join(basedir, 'medications_clean.csv'))
-diets = pd.read_csv(os.path.join(basedir, "diet_clean.csv"))
-doctors = pd.read_csv(os.path.join(basedir, "doctor_specialization_clean.csv"))  # disease → recommended specialist
+knowledge_base = KnowledgeBase(basedir)
 
 # ==========================================
 # Load BioBERT / DistilBERT Model and Tokenizer (OPTIONAL)
+# INFERENCE_BACKEND: 'torch' (PyTorch), 'onnx' (int8 export, see export_onnx.py)
+# or 'linear' (scikit-learn model distilled from it, see train_linear.py)
 # ==========================================
-MODEL_PATH = os.path.join(basedir, "medical_bert_model")
-model = None
-tokenizer = None
-device = None
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch').lower()
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(basedir, "medical_bert_model"))
+LINEAR_MODEL_PATH = os.environ.get('LINEAR_MODEL_PATH', os.path.join(basedir, inference.LINEAR_FILENAME))
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH')
+LABEL_ENCODER_PATH = os.path.join(basedir, 'label_encoder.pkl')
+
+def load_classifier():
+    classifier = inference.load_classifier(
+        INFERENCE_BACKEND,
+        MODEL_PATH,
+        onnx_path=ONNX_MODEL_PATH,
+        threads=int(os.environ.get('INFERENCE_THREADS', 0)) or None,
+        linear_path=LINEAR_MODEL_PATH
+    )
+    if classifier is None:
+        print("Running in rules-only mode (no ML model).")
+    elif getattr(classifier, 'wants_batching', True) and int(os.environ.get('INFERENCE_MAX_BATCH', 8)) > 1:
+        # Concurrent /predict calls share one padded forward pass
+        classifier = inference.MicroBatcher(
+            classifier,
+            max_batch=int(os.environ.get('INFERENCE_MAX_BATCH', 8)),
+            max_wait=float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5)) / 1000.0
+        )
+    return classifier
+
+classifier = inference.LazyResource("classifier", load_classifier)
 
-if ML_AVAILABLE:
+# Skip the model when the top rules candidate leads by at least this score (unset = only
+# skip when a single disease is allowed, which never changes the result)
+INFERENCE_SKIP_MARGIN = float(os.environ['INFERENCE_SKIP_MARGIN']) if os.environ.get('INFERENCE_SKIP_MARGIN') else None
+
+# Load Label Encoder
+def load_label_encoder():
     try:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        model.to(device)
-        print("Medical model loaded successfully.")
+        with open(LABEL_ENCODER_PATH, 'rb') as f:
+            le = pickle.load(f)
+        print("Label encoder loaded.")
+        return le
     except Exception as e:
-        print(f"ML model not loaded (optional): {e}")
-        model = None
-        tokenizer = None
-else:
-    print("Running in rules-only mode (no ML model).")
+        print(f"Label encoder not loaded (optional for rules-based mode): {e}")
+        return None
+
+le = inference.LazyResource("label_encoder", load_label_encoder)
+
+def _model_files():
+    """Files whose replacement must invalidate cached predictions."""
+    if INFERENCE_BACKEND == 'linear':
+        return LINEAR_MODEL_PATH, LABEL_ENCODER_PATH
+    if INFERENCE_BACKEND == 'onnx':
+        return MODEL_PATH, ONNX_MODEL_PATH, LABEL_ENCODER_PATH
+    return MODEL_PATH, LABEL_ENCODER_PATH
+
+# Repeated inputs (e.g. the original text inside every follow-up resubmission) skip the model.
+# PREDICTION_CACHE_PATH adds an SQLite file shared by all workers.
+prediction_cache = inference.PredictionCache(
+    maxsize=int(os.environ.get('PREDICTION_CACHE_SIZE', 2048)),
+    path=os.environ.get('PREDICTION_CACHE_PATH') or None,
+    namespace=f"{INFERENCE_BACKEND}:{inference.model_fingerprint(*_model_files())}"
+)
 
-# Load Label Encoder
-le = None
-try:
-    with open(os.path.join(basedir, 'label_encoder.pkl'), 'rb') as f:
-        le = pickle.load(f)
-    print("Label encoder loaded.")
-except Exception as e:
-    print(f"Label encoder not loaded (optional for rules-based mode): {e}")
+# MODEL_WARMUP: 'background' (default) loads everything in a thread right after boot,
+# 'lazy' waits for the first request that needs it (/ready loads the rules engine), 'eager' loads before serving
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'background').lower()
+if MODEL_WARMUP == 'eager':
+    for resource in (rules_engine, classifier, le):
+        resource.get()
+elif MODEL_WARMUP != 'lazy':
+    inference.warm_up([rules_engine, classifier, le])
 
 
 # ==========================================
 # Helper: fetch description, precautions, meds, diet, workout, doctor
 # ==========================================
 def helper(dis):
-    desc = description[description['Disease'] == dis]['Description']
-    if not desc.empty:
-        desc = " ".join([w for w in desc])
-    else:
-        desc = "No description available."
-
-    pre = precautions[precautions['Disease'] == dis][
-        ['Precaution_1', 'Precaution_2', 'Precaution_3', 'Precaution_4']
-    ]
-    if not pre.empty:
-        pre = [col for col in pre.values]
-    else:
-        pre = [[]]
-
-    med = medications[medications['Disease'] == dis]['Medication']
-    if not med.empty:
-        med_list = []
-        for m in med.values:
-            # Parse string list representations like "['item1', 'item2']"
-            if isinstance(m, str) and m.startswith('[') and m.endswith(']'):
-                import ast
-                try:
-                    parsed = ast.literal_eval(m)
-                    if isinstance(parsed, list):
-                        med_list.extend(parsed)
-                    else:
-                        med_list.append(m)
-                except:
-                    med_list.append(m)
-            else:
-                med_list.append(m)
-        med = med_list
-    else:
-        med = []
-
-    die = diets[diets['Disease'] == dis]['Diet']
-    if not die.empty:
-        die_list = []
-        for d in die.values:
-            # Parse string list representations like "['item1', 'item2']"
-            if isinstance(d, str) and d.startswith('[') and d.endswith(']'):
-                import ast
-                try:
-                    parsed = ast.literal_eval(d)
-                    if isinstance(parsed, list):
-                        die_list.extend(parsed)
-                    else:
-                        die_list.append(d)
-                except:
-                    die_list.append(d)
-            else:
-                die_list.append(d)
-        die = die_list
-    else:
-        die = []
-
-    wrkout = workout[workout['disease'] == dis]['workout']
-    if not wrkout.empty:
-        wrkout = [w for w in wrkout.values]
-    else:
-        wrkout = []
+    # O(1) lookup of the pre-parsed record; fresh lists so callers can mutate them
+    record = knowledge_base.get(dis)
+    return (
+        record.description,
+        [list(record.precautions)],
+        list(record.medications),
+        list(record.diets),
+        list(record.workouts),
+        list(record.doctors)
+    )
 
-    doc = doctors[doctors['Disease'] == dis]['Doctor']
-    if not doc.empty:
-        doc = [d for d in doc.values]
-    else:
-        doc = []
 
-    return desc, pre, med, die, wrkout, doc
+def build_analysis_record(confidence_level, confidence_score, reason, doctors, explanation,
+                          medications, precautions, diets, workouts):
+    """
+    Structured copy of a diagnosis stored in symptoms_logs.analysis (JSONB).
+    view_diagnosis renders from this, so it never re-runs the rules engine or helper().
+    """
+    def clean(items):
+        # Keep plain JSON strings only (drops NaN, which JSONB rejects)
+        return [str(i) for i in items if i == i]
+
+    return {
+        'confidence_level': confidence_level,
+        'confidence_score': float(confidence_score) if confidence_score is not None else None,
+        'reason': reason,
+        'doctors': clean(doctors),
+        'explanation': explanation,
+        'medications': clean(medications),
+        'precautions': clean(precautions),
+        'diets': clean(diets),
+        'workouts': clean(workouts)
+    }
 
 
 def get_predicted_value(user_text):
-    if model is None or tokenizer is None or le is None:
+    model, encoder = classifier.get(), le.get()
+    if model is None or encoder is None:
         return "System Error: Model not loaded"
 
-    inputs = tokenizer(
-        user_text,
-        return_tensors="pt",
-        truncation=True,
-        padding=True,
-        max_length=128
-    )
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        predicted_class_id = torch.argmax(logits, dim=-1).item()
-
-    predicted_disease = le.inverse_transform([predicted_class_id])[0]
+    key = None
+    if prediction_cache.enabled:
+        key = inference.canonical_text(user_text)
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            return cached[0]
+
+    start = monotonic()
+    logits = model.predict_logits([user_text])[0]
+    predicted_disease = encoder.inverse_transform([int(logits.argmax())])[0]
+    if key is not None:
+        prediction_cache.put(key, predicted_disease, logits, monotonic() - start)
     return predicted_disease
 
 
@@ -232,45 +230,67 @@ def sitemap():
 def robots():
     return send_from_directory('static', 'robots.txt')
 
+# Readiness: 200 once diagnosis can run (rules engine loaded successfully); ML is reported but optional
+@app.route('/ready')
+def ready():
+    # The rules engine is cheap and required: with MODEL_WARMUP=lazy nothing else loads it
+    # before traffic arrives, so the probe does (a load already in progress isn't waited on)
+    if rules_engine.status()['state'] == 'not_loaded':
+        rules_engine.get()
+    components = {
+        'rules_engine': rules_engine.status(),
+        'knowledge_base': {'state': 'ready', 'diseases': len(knowledge_base)},
+        'classifier': classifier.status(),
+        'label_encoder': le.status(),
+        'prediction_cache': prediction_cache.stats()
+    }
+    is_ready = components['rules_engine']['state'] == 'ready'
+    ml_ready = components['classifier']['state'] == 'ready' and components['label_encoder']['state'] == 'ready'
+    return jsonify({'ready': is_ready, 'ml_ready': ml_ready, 'components': components}), (200 if is_ready else 503)
+
+# Homepage stats: one aggregate query, cached per worker for HOME_STATS_TTL seconds
+HOME_STATS_TTL = float(os.environ.get('HOME_STATS_TTL', 300))
+_home_stats = {'data': None, 'expires': 0.0}
+_home_stats_lock = threading.Lock()
+
+def get_home_stats():
+    """
+    Returns {'users', 'doctors', 'diagnoses', 'appointments'} counts.
+    Served from memory until the TTL expires; only one thread refreshes at a time,
+    and the last good values are kept if the database is unavailable.
+    """
+    now = monotonic()
+    if _home_stats['data'] is not None and now < _home_stats['expires']:
+        return _home_stats['data']
+
+    with _home_stats_lock:
+        if _home_stats['data'] is not None and monotonic() < _home_stats['expires']:
+            return _home_stats['data']
+        try:
+            with database.connection() as conn:
+                cursor = database.get_dict_cursor(conn)
+                cursor.execute("""
+                    SELECT
+                        (SELECT COUNT(*) FROM users) AS users,
+                        (SELECT COUNT(*) FROM doctors) AS doctors,
+                        (SELECT COUNT(*) FROM symptoms_logs) AS diagnoses,
+                        (SELECT COUNT(*) FROM appointments) AS appointments
+                """)
+                row = cursor.fetchone()
+                cursor.close()
+            _home_stats['data'] = {key: int(value or 0) for key, value in row.items()}
+            _home_stats['expires'] = monotonic() + HOME_STATS_TTL
+        except Exception as e:
+            print(f"Stats Error: {e}")
+            # Back off instead of hitting a failing database on every homepage request
+            _home_stats['expires'] = monotonic() + min(HOME_STATS_TTL, 30)
+
+    return _home_stats['data'] or {'users': 0, 'doctors': 0, 'diagnoses': 0, 'appointments': 0}
+
 @app.route("/")
 def index():
-    # Fetch real stats from database for home page
-    stats = {
-        'users': 0,
-        'doctors': 0,
-        'diagnoses': 0,
-        'appointments': 0
-    }
-    try:
-        conn = database.get_db_connection()
-        cursor = database.get_dict_cursor(conn)
-        
-        # Count all users
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        result = cursor.fetchone()
-        stats['users'] = result['count'] if result else 0
-        
-        # Count doctors
-        cursor.execute("SELECT COUNT(*) as count FROM doctors")
-        result = cursor.fetchone()
-        stats['doctors'] = result['count'] if result else 0
-        
-        # Count diagnoses
-        cursor.execute("SELECT COUNT(*) as count FROM symptoms_logs")
-        result = cursor.fetchone()
-        stats['diagnoses'] = result['count'] if result else 0
-        
-        # Count appointments
-        cursor.execute("SELECT COUNT(*) as count FROM appointments")
-        result = cursor.fetchone()
-        stats['appointments'] = result['count'] if result else 0
-        
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Stats Error: {e}")
-    
-    return render_template("index.html", stats=stats)
+    # Fetch real stats from database for home page (cached)
+    return render_template("index.html", stats=get_home_stats())
 
 
 @app.route('/check_symptoms')
@@ -340,16 +360,19 @@ def predict():
             gender = gender.strip().lower() if gender and gender.strip() else None
             
             # --- RULES ENGINE INTEGRATION ---
-            analysis = rules_engine.run_analysis(symptoms)
+            engine = rules_engine.get()
+            if engine is None:
+                flash("Diagnosis is temporarily unavailable (the rules engine failed to load). Please try again later.", "danger")
+                return redirect(url_for('check_symptoms'))
+            analysis = engine.run_analysis(symptoms)
             
             # --- POST-PROCESSING: Apply demographic context (OPTIONAL, NON-INVASIVE) ---
             # This ONLY adjusts confidence score, NEVER changes disease prediction
-            analysis = rules_engine.apply_demographic_context(analysis, age=age, gender=gender)
+            analysis = engine.apply_demographic_context(analysis, age=age, gender=gender)
 
             # 1. EMERGENCY HANDLING
             if analysis['emergency']:
                 # --- START EMERGENCY LOGGING ---
-                import os
                 # 1. Define Emergency Variables
                 predicted_disease = "EMERGENCY ALERT"
                 dis_des = f"The system detected potential signs of a medical emergency: {analysis['reason']}. Please proceed to a hospital or consult the recommended specialist immediately."
@@ -358,28 +381,12 @@ def predict():
                 my_diet = []
                 workout = []
                 
-                # 2. Generate PDF (Guarded)
-                pdf_path = None
-                try:
-                    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                    pdf_filename = f"report_{session.get('user_id', 'guest')}_{timestamp}.pdf"
-                    # Store relative in DB for portability
-                    pdf_path = os.path.join("static", "reports", pdf_filename)
-                    
-                    # Use absolute for generation
-                    abs_pdf_path = os.path.join(basedir, pdf_path)
-                    os.makedirs(os.path.dirname(abs_pdf_path), exist_ok=True)
-                    
-                    patient_name = session.get('name', 'Guest')
-                    utils.generate_pdf_report(
-                        abs_pdf_path, patient_name, predicted_disease, symptoms, 
-                        dis_des, meds, my_precautions, my_diet, workout, age=age, gender=gender
-                    )
-                except Exception as pdf_e:
-                    print(f"Emergency PDF Generation Failed (Skipping): {pdf_e}")
-                    pdf_path = None
-
-                # 3. Log to DB
+                # 2. Log to DB (analysis record lets view_diagnosis render without re-running NLP).
+                # No PDF here: /download_report renders it on first request (report_status: pending/ready/failed)
+                analysis_record = build_analysis_record(
+                    "HIGH", 1.0, "Emergency symptoms detected.", ["Emergency Specialist"], {},
+                    meds, my_precautions, my_diet, workout
+                )
                 log_id = None
                 try:
                     conn = database.get_db_connection()
@@ -387,11 +394,11 @@ def predict():
                     cursor.execute(
                         """
                         INSERT INTO symptoms_logs 
-                        (patient_id, symptoms_text, disease_predicted, description, medications, precautions, diets, workouts, pdf_path)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        (patient_id, symptoms_text, disease_predicted, description, medications, precautions, diets, workouts, patient_age, patient_gender, analysis, report_status)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending')
                         RETURNING id
                         """,
-                        (session['user_id'], symptoms, predicted_disease, dis_des, str(meds), str(my_precautions), str(my_diet), str(workout), pdf_path)
+                        (session['user_id'], symptoms, predicted_disease, dis_des, str(meds), str(my_precautions), str(my_diet), str(workout), age, gender, database.json_param(analysis_record))
                     )
                     log_id = cursor.fetchone()[0]
                     conn.commit()
@@ -419,7 +426,11 @@ def predict():
                 confidence_level = analysis.get('confidence_level', 'LOW')
             else:
                 # 3. STANDARD PREDICTION
-                raw_prediction = get_predicted_value(symptoms)
+                # The model only picks between allowed diseases; skip it when rules already decide
+                if inference.should_run_model(analysis, INFERENCE_SKIP_MARGIN):
+                    raw_prediction = get_predicted_value(symptoms)
+                else:
+                    raw_prediction = analysis['allowed_diseases'][0]
                 
                 if raw_prediction in analysis['allowed_diseases']:
                     predicted_disease = raw_prediction
@@ -439,29 +450,26 @@ def predict():
             session['last_predicted_disease'] = predicted_disease
             session['last_symptoms_text'] = symptoms
 
-            import os
-            # 1. Generate PDF (Guarded)
-            pdf_path = None
-            try:
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                pdf_filename = f"report_{session.get('user_id', 'guest')}_{timestamp}.pdf"
-                # Store relative in DB
-                pdf_path = os.path.join("static", "reports", pdf_filename)
-                
-                # Use absolute for generation
-                abs_pdf_path = os.path.join(basedir, pdf_path)
-                os.makedirs(os.path.dirname(abs_pdf_path), exist_ok=True)
-                
-                patient_name = session.get('name', 'Guest')
-                utils.generate_pdf_report(
-                    abs_pdf_path, patient_name, predicted_disease, symptoms, 
-                    dis_des, meds, my_precautions, rec_diet, wrk, age=age, gender=gender
-                )
-            except Exception as pdf_e:
-                print(f"PDF Generation Failed (Skipping to prevent crash): {pdf_e}")
-                pdf_path = None # Ensure logic proceeds without PDF
-
-            # 2. Log to DB
+            # UX Feature: Explanation data for "Why this diagnosis?" panel
+            explanation = {
+                'matched_primary': analysis.get('matched_primary', []),
+                'matched_supporting': analysis.get('matched_supporting', []),
+                'missing_primary': analysis.get('missing_primary', []),
+                'newly_confirmed': newly_confirmed_symptoms if is_followup else []  # Symptoms confirmed via follow-up
+            }
+            
+            # Generate updated reason text if follow-up improved confidence
+            reason_text = analysis.get('reason', '')
+            if is_followup and newly_confirmed_symptoms:
+                reason_text = f"Follow-up answers confirmed additional symptoms, improving diagnosis confidence."
+            
+            # Log to DB (analysis record lets view_diagnosis render without re-running NLP).
+            # No PDF here: /download_report renders it on first request (report_status: pending/ready/failed)
+            display_reason = reason_text if not is_fallback else "Symptoms are non-specific."
+            analysis_record = build_analysis_record(
+                confidence_level, analysis.get('confidence_score'), display_reason, my_doctor,
+                explanation if not is_fallback else {}, meds, my_precautions, rec_diet, wrk
+            )
             log_id = None
             try:
                 conn = database.get_db_connection()
@@ -471,11 +479,11 @@ def predict():
                 cursor.execute(
                     """
                     INSERT INTO symptoms_logs 
-                    (patient_id, symptoms_text, disease_predicted, description, medications, precautions, diets, workouts, pdf_path, confidence_level, recommended_specialist, patient_age, patient_gender)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    (patient_id, symptoms_text, disease_predicted, description, medications, precautions, diets, workouts, confidence_level, recommended_specialist, patient_age, patient_gender, analysis, report_status)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending')
                     RETURNING id
                     """,
-                    (session['user_id'], symptoms, predicted_disease, dis_des, str(meds), str(my_precautions), str(rec_diet), str(wrk), pdf_path, confidence_level, specialist, age, gender)
+                    (session['user_id'], symptoms, predicted_disease, dis_des, str(meds), str(my_precautions), str(rec_diet), str(wrk), confidence_level, specialist, age, gender, database.json_param(analysis_record))
                 )
                 log_id = cursor.fetchone()[0]
                 conn.commit()
@@ -499,19 +507,6 @@ def predict():
                 if original_confidence == 'LOW' and confidence_level == 'HIGH':
                     confidence_level = 'MEDIUM'  # Cap to one level improvement
             
-            # UX Feature: Explanation data for "Why this diagnosis?" panel
-            explanation = {
-                'matched_primary': analysis.get('matched_primary', []),
-                'matched_supporting': analysis.get('matched_supporting', []),
-                'missing_primary': analysis.get('missing_primary', []),
-                'newly_confirmed': newly_confirmed_symptoms if is_followup else []  # Symptoms confirmed via follow-up
-            }
-            
-            # Generate updated reason text if follow-up improved confidence
-            reason_text = analysis.get('reason', '')
-            if is_followup and newly_confirmed_symptoms:
-                reason_text = f"Follow-up answers confirmed additional symptoms, improving diagnosis confidence."
-            
             # POST/REDIRECT/GET Pattern: Redirect to view_diagnosis to prevent form resubmission on back button
             # Pass followup_result flag via URL parameter if this was a follow-up analysis
             redirect_url = url_for('view_diagnosis', log_id=log_id)
@@ -540,50 +535,33 @@ def view_diagnosis(log_id):
         flash("Diagnosis record not found.", "danger")
         return redirect(url_for('patient_dashboard'))
 
-    def parse_list(data_str):
-        try:
-            return ast.literal_eval(data_str) if data_str else []
-        except:
-            return []
-
     predicted_disease = log['disease_predicted']
     
     # Helper to clean description
     dis_des = log['description']
     
-    # Recalculate doctor safely
-    if predicted_disease == "EMERGENCY ALERT":
-        my_doctor = ["Emergency Specialist"]
-        confidence_level = "HIGH"
-        reason = "Emergency symptoms detected."
-    elif predicted_disease == "General Physician Consultation":
-        my_doctor = ["General Physician"]
-        confidence_level = "LOW"
-        reason = "Symptoms are non-specific."
+    record = log.get('analysis')
+    if record:
+        # Stored by /predict: render straight from the row (no NLP / CSV lookups)
+        my_doctor = record.get('doctors') or ["General Physician"]
+        confidence_level = record.get('confidence_level') or log.get('confidence_level') or "MEDIUM"
+        reason = record.get('reason', "")
+        explanation = record.get('explanation') or {}
+        medications = record.get('medications', [])
+        my_precautions = record.get('precautions', [])
+        my_diet = record.get('diets', [])
+        workout = record.get('workouts', [])
     else:
-        try:
-            _, _, _, _, _, my_doctor = helper(predicted_disease)
-            confidence_level = "MEDIUM" # Default for old logs
-        except:
-            my_doctor = ["General Physician"]
-            confidence_level = "LOW"
-            reason = "Prediction data unavailable."
+        my_doctor, confidence_level, reason, explanation = legacy_diagnosis_details(log)
+        medications = parse_list(log['medications'])
+        my_precautions = parse_list(log['precautions'])
+        my_diet = parse_list(log['diets'])
+        workout = parse_list(log['workouts'])
     
-    medications = parse_list(log['medications'])
-    my_precautions = parse_list(log['precautions'])
-    my_diet = parse_list(log['diets'])
-    workout = parse_list(log['workouts'])
-    
-    pdf_path_rel = log['pdf_path']
-    if pdf_path_rel:
-        filename = os.path.basename(pdf_path_rel)
-        pdf_report_url = url_for('static', filename=f'reports/{filename}')
-    else:
-        pdf_report_url = "#"
-
-    # Logic moved above for safety
-    if 'reason' not in locals():
-        reason = ""
+    # Report is rendered (or re-rendered if the file is gone) on first download;
+    # after a failed render the link becomes an explicit retry
+    report_failed = log.get('report_status') == 'failed'
+    pdf_report_url = url_for('download_report', log_id=log['id'], retry=1 if report_failed else None)
     
     # Handle show_followup query parameter (for PRG pattern from /predict)
     show_followup_param = request.args.get('show_followup', 'false').lower() == 'true'
@@ -591,29 +569,12 @@ def view_diagnosis(log_id):
     # Generate follow-up questions if needed
     fq = []
     show_followup = False
-    explanation = {}
     
     if show_followup_param and confidence_level in ['LOW', 'MEDIUM']:
         # Check if we should show follow-up questions
         if followup_questions.should_show_followup(confidence_level):
             fq = followup_questions.get_followup_questions(predicted_disease)
             show_followup = True if fq else False
-    
-    # Run rules analysis to get explanation data
-    if predicted_disease not in ["EMERGENCY ALERT", "General Physician Consultation"]:
-        analysis = rules_engine.run_analysis(log['symptoms_text'])
-        explanation = {
-            'matched_primary': analysis.get('matched_primary', []),
-            'matched_supporting': analysis.get('matched_supporting', []),
-            'missing_primary': analysis.get('missing_primary', []),
-            'newly_confirmed': []
-        }
-        # Use stored confidence if available, else use analysis
-        if log.get('confidence_level'):
-            confidence_level = log['confidence_level']
-        else:
-            confidence_level = analysis.get('confidence_level', 'MEDIUM')
-        reason = analysis.get('reason', reason)
 
     return render_template('check_symptoms.html', 
         predicted_disease=predicted_disease, 
@@ -625,6 +586,7 @@ def view_diagnosis(log_id):
         my_doctor=my_doctor, 
         user_input=log['symptoms_text'], 
         pdf_report_url=pdf_report_url, 
+        report_failed=report_failed,
         log_id=log['id'],
         confidence_level=confidence_level,
         reason=reason,
@@ -634,6 +596,97 @@ def view_diagnosis(log_id):
     )
 
 
+def parse_list(data_str):
+    try:
+        return ast.literal_eval(data_str) if data_str else []
+    except:
+        return []
+
+
+def legacy_diagnosis_details(log):
+    """
+    Rows saved before symptoms_logs.analysis existed: recalculate doctor,
+    confidence, reason and explanation from the stored symptoms text.
+    """
+    predicted_disease = log['disease_predicted']
+    explanation = {}
+    reason = ""
+    
+    # Recalculate doctor safely
+    if predicted_disease == "EMERGENCY ALERT":
+        return ["Emergency Specialist"], "HIGH", "Emergency symptoms detected.", explanation
+    if predicted_disease == "General Physician Consultation":
+        return ["General Physician"], "LOW", "Symptoms are non-specific.", explanation
+    
+    try:
+        _, _, _, _, _, my_doctor = helper(predicted_disease)
+    except:
+        my_doctor = ["General Physician"]
+        reason = "Prediction data unavailable."
+    
+    # Run rules analysis to get explanation data
+    engine = rules_engine.get()
+    analysis = engine.run_analysis(log['symptoms_text']) if engine else {}
+    explanation = {
+        'matched_primary': analysis.get('matched_primary', []),
+        'matched_supporting': analysis.get('matched_supporting', []),
+        'missing_primary': analysis.get('missing_primary', []),
+        'newly_confirmed': []
+    }
+    # Use stored confidence if available, else use analysis
+    confidence_level = log.get('confidence_level') or analysis.get('confidence_level', 'MEDIUM')
+    reason = analysis.get('reason', reason)
+    return my_doctor, confidence_level, reason, explanation
+
+
+def render_report(log, patient_name):
+    """
+    Renders the PDF report for a symptoms_logs row and records the result.
+    Returns the relative pdf_path, or None if rendering failed.
+    """
+    record = log.get('analysis') or {}
+    if record:
+        meds = record.get('medications', [])
+        my_precautions = record.get('precautions', [])
+        my_diet = record.get('diets', [])
+        wrk = record.get('workouts', [])
+    else:
+        meds = parse_list(log['medications'])
+        my_precautions = parse_list(log['precautions'])
+        my_diet = parse_list(log['diets'])
+        wrk = parse_list(log['workouts'])
+
+    # Store relative in DB for portability
+    pdf_path = os.path.join("static", "reports", f"report_{log['patient_id']}_{log['id']}.pdf")
+    try:
+        # Use absolute for generation
+        abs_pdf_path = os.path.join(basedir, pdf_path)
+        os.makedirs(os.path.dirname(abs_pdf_path), exist_ok=True)
+        utils.generate_pdf_report(
+            abs_pdf_path, patient_name, log['disease_predicted'], log['symptoms_text'],
+            log['description'], meds, my_precautions, my_diet, wrk,
+            age=log.get('patient_age'), gender=log.get('patient_gender')
+        )
+        status = 'ready'
+    except Exception as pdf_e:
+        print(f"PDF Generation Failed: {pdf_e}")
+        pdf_path = None
+        status = 'failed'
+
+    try:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE symptoms_logs SET pdf_path=%s, report_status=%s WHERE id=%s",
+                (pdf_path, status, log['id'])
+            )
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        print(f"Report Status Error: {e}")
+    return pdf_path
+
+
 @app.route('/download_report/<int:log_id>')
 def download_report(log_id):
     if 'user_id' not in session:
@@ -641,19 +694,32 @@ def download_report(log_id):
         
     conn = database.get_db_connection()
     cursor = database.get_dict_cursor(conn)
-    cursor.execute("SELECT pdf_path FROM symptoms_logs WHERE id=%s AND patient_id=%s", (log_id, session['user_id']))
+    cursor.execute("SELECT * FROM symptoms_logs WHERE id=%s AND patient_id=%s", (log_id, session['user_id']))
     log = cursor.fetchone()
     cursor.close()
     conn.close()
     
-    if log and log['pdf_path']:
+    if not log:
+        flash("Report not found or access denied.", "danger")
+        return redirect(url_for('patient_dashboard'))
+
+    pdf_path = log['pdf_path']
+    # Lazy rendering: first download (or the file was lost on an ephemeral disk).
+    # A failed render is only retried when the user asks for it (?retry=1)
+    if not pdf_path or not os.path.exists(os.path.join(basedir, pdf_path)):
+        if log.get('report_status') == 'failed' and not request.args.get('retry'):
+            flash("Report generation failed. Use \"Retry PDF Report\" on the diagnosis page to try again.", "warning")
+            return redirect(url_for('view_diagnosis', log_id=log_id))
+        pdf_path = render_report(log, session.get('name', 'Guest'))
+
+    if pdf_path:
         from flask import send_file
         # Ensure absolute path for sending
-        abs_path = os.path.join(basedir, log['pdf_path'])
+        abs_path = os.path.join(basedir, pdf_path)
         return send_file(abs_path, as_attachment=True)
     else:
-        flash("Report not found or access denied.", "danger")
-        return redirect(url_for('home'))
+        flash("Report could not be generated. Please try again later.", "danger")
+        return redirect(url_for('view_diagnosis', log_id=log_id))
 
 
 @app.route('/about')
@@ -693,8 +759,8 @@ def signup():
         pincode = request.form['pincode']
         history = request.form.get('medical_history', '')
         
-        # Geocode (OpenStreetMap)
-        lat, lng = utils.geocode_address(address, city, pincode)
+        # Geocode: instant cache/gazetteer estimate now, Nominatim in the background
+        lat, lng = utils.geocode_address(address, city, pincode, network=False)
 
         try:
             cursor.execute(
@@ -703,6 +769,7 @@ def signup():
             )
             user_id = cursor.fetchone()[0]
             conn.commit()
+            utils.geocode_queue.enqueue('users', user_id, address, city, pincode)
             
             # Log Activity
             utils.log_activity(user_id, 'patient', 'signup', f"New patient registered: {email}")
@@ -932,8 +999,9 @@ def update_patient_profile():
     except (ValueError, TypeError):
         age = None
 
-    # Re-geocode
-    lat, lng = utils.geocode_address(address, city, pincode)
+    # Re-geocode only if the address changed: instant estimate now, Nominatim in the background
+    regeocode = utils.address_changed('users', user_id, address, city, pincode)
+    lat, lng = utils.geocode_address(address, city, pincode, network=False) if regeocode else (None, None)
 
     conn = database.get_db_connection()
     cursor = conn.cursor()
@@ -950,6 +1018,8 @@ def update_patient_profile():
                 (name, city, address, pincode, history, age, gender, user_id)
             )
         conn.commit()
+        if regeocode:
+            utils.geocode_queue.enqueue('users', user_id, address, city, pincode)
         session['name'] = name # Update session name
         flash("Profile Updated Successfully", "success")
     except Exception as e:
@@ -966,22 +1036,22 @@ def update_patient_profile():
     return redirect(url_for('patient_dashboard'))
 
 
+# Doctors shown per page in view_doctors
+DOCTORS_PAGE_SIZE = int(os.environ.get('DOCTORS_PAGE_SIZE', 20))
+
 @app.route('/view_doctors')
 def view_doctors():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    specialization = request.args.get('specialization')
+    specialization = request.args.get('specialization') or None
+    search = request.args.get('q', '').strip()
     log_id = request.args.get('log_id')
+    page = max(request.args.get('page', 1, type=int), 1)
+    offset = (page - 1) * DOCTORS_PAGE_SIZE
     conn = database.get_db_connection()
     cursor = database.get_dict_cursor(conn)
 
-    if specialization:
-        cursor.execute("SELECT * FROM doctors WHERE specialization = %s", (specialization,))
-    else:
-        cursor.execute("SELECT * FROM doctors")
-    doctors_list = cursor.fetchall()
-
     cursor.execute("SELECT name FROM specializations ORDER BY name ASC")
     specs = [row['name'] for row in cursor.fetchall()]
 
@@ -996,8 +1066,22 @@ def view_doctors():
                 address_incomplete = True
             if patient.get('lat') and patient.get('lng'):
                 patient_coords = {'lat': patient['lat'], 'lng': patient['lng']}
-                # Use Utility
-                utils.process_doctors_data(doctors_list, patient['lat'], patient['lng'])
+
+    if patient_coords:
+        # Nearest first, computed in the database one page at a time
+        doctors_list, has_more = utils.nearest_doctors(
+            cursor, patient_coords['lat'], patient_coords['lng'],
+            specialization=specialization, limit=DOCTORS_PAGE_SIZE, offset=offset, search=search
+        )
+    else:
+        filters, params = utils.doctor_filters(specialization, search)
+        cursor.execute(
+            f"SELECT * FROM doctors WHERE TRUE {filters} ORDER BY id LIMIT %(limit)s OFFSET %(offset)s",
+            dict(params, limit=DOCTORS_PAGE_SIZE + 1, offset=offset)
+        )
+        doctors_list = cursor.fetchall()
+        has_more = len(doctors_list) > DOCTORS_PAGE_SIZE
+        doctors_list = doctors_list[:DOCTORS_PAGE_SIZE]
 
     # Normalize time fields for JSON serialization compatibility
     # Normalize fields for JSON serialization compatibility (Decimal, Time, Date)
@@ -1032,7 +1116,11 @@ def view_doctors():
         specializations=specs,
         patient_coords=patient_coords,
         address_incomplete=address_incomplete,
-        log_id=log_id
+        log_id=log_id,
+        specialization=specialization,
+        search=search,
+        page=page,
+        has_more=has_more
     )
 
 
@@ -1102,15 +1190,8 @@ def confirm_booking():
         )
         conn.commit()
         
-        # Log Activity (Inlined to reuse connection)
-        try:
-            cursor.execute(
-                "INSERT INTO activity_logs (user_id, role, action, details) VALUES (%s, %s, %s, %s)",
-                (patient_id, 'patient', 'book_appointment', f"Booked Dr. ID {doctor_id} on {appt_date} at {appt_time}")
-            )
-            conn.commit()
-        except Exception as log_e:
-            print(f"Logging Error: {log_e}") # Non-blocking
+        # Log Activity (queued, written in the background)
+        utils.log_activity(patient_id, 'patient', 'book_appointment', f"Booked Dr. ID {doctor_id} on {appt_date} at {appt_time}")
 
         return render_template('appointment_confirmed.html')
     except Exception as e:
@@ -1204,8 +1285,9 @@ def update_doctor_profile():
     start_time = request.form.get('start_time')
     end_time = request.form.get('end_time')
     
-    # Re-geocode
-    lat, lng = utils.geocode_address(address, city, pincode)
+    # Re-geocode only if the address changed: instant estimate now, Nominatim in the background
+    regeocode = utils.address_changed('doctors', doctor_id, address, city, pincode)
+    lat, lng = utils.geocode_address(address, city, pincode, network=False) if regeocode else (None, None)
 
     conn = database.get_db_connection()
     cursor = conn.cursor()
@@ -1221,6 +1303,8 @@ def update_doctor_profile():
                 (name, specialization, fees, description, city, address, pincode, meeting_link, start_time, end_time, doctor_id)
             )
         conn.commit()
+        if regeocode:
+            utils.geocode_queue.enqueue('doctors', doctor_id, address, city, pincode)
         utils.log_activity(doctor_id, 'doctor', 'update_profile', "Updated profile details")
         flash("Profile Updated", "success")
     except Exception as e:
@@ -1405,7 +1489,8 @@ def add_doctor():
 
     hashed_password = generate_password_hash(password)
     
-    lat, lng = utils.geocode_address(address, city, pincode)
+    # Instant cache/gazetteer estimate now, Nominatim in the background
+    lat, lng = utils.geocode_address(address, city, pincode, network=False)
 
     conn = database.get_db_connection()
     cursor = conn.cursor()
@@ -1416,6 +1501,7 @@ def add_doctor():
         )
         doctor_id = cursor.fetchone()[0]
         conn.commit()
+        utils.geocode_queue.enqueue('doctors', doctor_id, address, city, pincode)
         utils.log_activity(session['user_id'], 'admin', 'add_doctor', f"Added doctor {name} ({specialization})")
         flash("Doctor Added Successfully", "success")
     except Exception as e:
@@ -1442,8 +1528,9 @@ def update_doctor():
     address = request.form['address']
     pincode = request.form['pincode']
     
-    # Re-geocode
-    lat, lng = utils.geocode_address(address, city, pincode)
+    # Re-geocode only if the address changed: instant estimate now, Nominatim in the background
+    regeocode = utils.address_changed('doctors', doctor_id, address, city, pincode)
+    lat, lng = utils.geocode_address(address, city, pincode, network=False) if regeocode else (None, None)
 
     conn = database.get_db_connection()
     cursor = conn.cursor()
@@ -1459,6 +1546,8 @@ def update_doctor():
                 (name, email, specialization, fees, city, address, pincode, doctor_id)
             )
         conn.commit()
+        if regeocode:
+            utils.geocode_queue.enqueue('doctors', doctor_id, address, city, pincode)
         utils.log_activity(session['user_id'], 'admin', 'update_doctor', f"Updated doctor {name} (ID: {doctor_id})")
         flash("Doctor Details Updated", "success")
     except Exception as e:
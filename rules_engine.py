@@ -1,7 +1,68 @@
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU map with hit/miss/eviction counters.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __getstate__(self):
+        # Locks can't be pickled (process pools); ship an empty cache of the same size
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0
+            }
+
 
 class RulesEngine:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         # Refactored: Primary + Supporting Symptom Logic
         self.disease_rules = {
             "Psoriasis": {
@@ -722,16 +783,40 @@ class RulesEngine:
             "attacks": "attack", "flares": "flare"
         }
         
-    def normalize_text(self, text):
-        return text.lower().strip()
+        # run_analysis() results keyed on normalized text (cleared on every rebuild)
+        self._analysis_cache = LRUCache(cache_size)
+        
+        # Precompile normalization patterns once (avoids per-request regex compilation)
+        self._build_matchers()
+        
+    def reload_rules(self, disease_rules=None, symptom_aliases=None, global_aliases=None, plurals=None):
+        """
+        Replaces any of the rule tables and rebuilds the matchers.
+        Cached analysis results are dropped so no stale diagnosis is served.
+        """
+        if disease_rules is not None:
+            self.disease_rules = disease_rules
+        if symptom_aliases is not None:
+            self.symptom_aliases = symptom_aliases
+        if global_aliases is not None:
+            self.global_aliases = global_aliases
+        if plurals is not None:
+            self.plurals = plurals
+        self._build_matchers()
 
-    def normalize_user_text(self, text):
+    def cache_stats(self):
+        """Returns hit/miss/eviction counters of the analysis cache."""
+        return self._analysis_cache.stats()
+        
+    def _build_matchers(self):
         """
-        Industry-grade normalization: handles Hinglish, grammar, and synonyms.
+        Compiles the phrase fixes and alias table used by normalize_user_text().
+        Must be re-run whenever global_aliases or the phrase fixes change.
         """
-        text = self.normalize_text(text)
+        # Any rebuild means the rule tables may have changed
+        self._analysis_cache.clear()
         
-        # 0. Pre-process compound phrases (handles multi-word Hinglish patterns)
+        # 0. Compound phrase fixes (multi-word Hinglish patterns)
         phrase_fixes = [
             (r"saans\s*phool\s*rahi", "saans phoolna"),
             (r"jal\s*raha\s*hai", "burning"),
@@ -747,8 +832,50 @@ class RulesEngine:
             (r"mosquito.*?fever", "high fever pain behind eyes joint pain"),
             (r"fever.*?mosquito", "high fever pain behind eyes joint pain"),
         ]
-        for pattern, replacement in phrase_fixes:
-            text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+        self._phrase_fixes = [(re.compile(pattern, flags=re.IGNORECASE), replacement)
+                              for pattern, replacement in phrase_fixes]
+        
+        # 2. Global aliases, longest first (stable sort keeps dict order for ties).
+        # Aliases cascade (e.g. "saans lene me takleef" -> "shortness of breath ..." is
+        # then rewritten by "shortness of breath"), so they are applied in sequence
+        # rather than in one alternation pass. Each entry: (alias, compiled_or_None, canonical)
+        sorted_aliases = sorted(self.global_aliases.items(), key=lambda x: len(x[0]), reverse=True)
+        self._alias_table = []
+        for alias, canonical in sorted_aliases:
+            if len(alias) > 3:
+                self._alias_table.append((alias, re.compile(rf'\b{re.escape(alias)}\b'), canonical))
+            else:
+                self._alias_table.append((alias, None, canonical))
+        
+        # 3. Inverted symptom index for check_rules(): canonical term -> diseases using it.
+        # Each term is tested once per request (itself + its symptom_aliases), and only
+        # diseases with at least one hit are scored.
+        self._disease_order = {disease: i for i, disease in enumerate(self.disease_rules)}
+        self._term_index = {}
+        for disease, rules in self.disease_rules.items():
+            for term in rules["primary"] + rules["supporting"]:
+                diseases = self._term_index.setdefault(term, [])
+                if disease not in diseases:
+                    diseases.append(disease)
+        # Flat (needle, canonical term) pairs: the term itself plus each of its aliases
+        self._term_needles = [(needle, term) for term in self._term_index
+                              for needle in (term, *self.symptom_aliases.get(term, []))]
+        
+        # 4. Term x disease matrices for run_analysis_many(), built on first use
+        self._batch_tables = None
+        
+    def normalize_text(self, text):
+        return text.lower().strip()
+
+    def normalize_user_text(self, text):
+        """
+        Industry-grade normalization: handles Hinglish, grammar, and synonyms.
+        """
+        text = self.normalize_text(text)
+        
+        # 0. Pre-process compound phrases (handles multi-word Hinglish patterns)
+        for pattern, replacement in self._phrase_fixes:
+            text = pattern.sub(replacement, text)
         
         # 1. Handle Plurals/Variations
         words = text.split()
@@ -756,12 +883,14 @@ class RulesEngine:
         text = " ".join(normalized_words)
         
         # 2. Map Global Aliases (Hinglish + Synonyms)
-        # We sort by length descending to replace longer phrases first
-        sorted_aliases = sorted(self.global_aliases.items(), key=lambda x: len(x[0]), reverse=True)
-        for alias, canonical in sorted_aliases:
-            # Check for alias in text using word boundaries for safety but allow simple replace for common Hinglish
-            if len(alias) > 3:
-                text = re.sub(rf'\b{re.escape(alias)}\b', canonical, text)
+        # Table is pre-sorted by length descending to replace longer phrases first
+        for alias, pattern, canonical in self._alias_table:
+            # Cheap substring gate: neither replacement can fire if the alias is absent
+            if alias not in text:
+                continue
+            # Word boundaries for safety but allow simple replace for common Hinglish
+            if pattern is not None:
+                text = pattern.sub(canonical, text)
             else:
                 text = text.replace(alias, canonical)
             
@@ -881,14 +1010,23 @@ class RulesEngine:
         text = self.normalize_text(user_symptoms)
         candidates = []
 
-        for disease, rules in self.disease_rules.items():
+        # 0. Single scan: which canonical terms (or their aliases) appear in the text
+        matched_terms = {term for needle, term in self._term_needles if needle in text}
+        
+        # Diseases without any hit can never pass the acceptance criteria below.
+        # Keep rule-table order so the stable sort breaks score ties as before.
+        hit_diseases = {disease for term in matched_terms for disease in self._term_index[term]}
+        
+        for disease in sorted(hit_diseases, key=self._disease_order.get):
+            rules = self.disease_rules[disease]
+            
             # 1. Exclusions (Discard immediately)
             if any(excl in text for excl in rules["exclusions"]):
                 continue
 
-            # 2. Symptom Matching (NLP Aware)
-            primary_matches = [p for p in rules["primary"] if self.match_symptom(p, text)]
-            supporting_matches = [s for s in rules["supporting"] if self.match_symptom(s, text)]
+            # 2. Symptom Matching (NLP Aware, same semantics as match_symptom)
+            primary_matches = [p for p in rules["primary"] if p in matched_terms]
+            supporting_matches = [s for s in rules["supporting"] if s in matched_terms]
 
             # 3. Acceptance Criteria:
             # - At least 1 primary match
@@ -912,30 +1050,8 @@ class RulesEngine:
             supporting_weight = 0.3
             confidence_score = (p_ratio * primary_weight) + (s_ratio * supporting_weight)
 
-            # 4. Confidence Level Mapping
-            if confidence_score >= 0.75:
-                # 0.75+ -> Strong match
-                confidence_level = "HIGH"
-            elif confidence_score >= 0.40:
-                # 0.40+ -> Decent match
-                confidence_level = "MEDIUM"
-            else:
-                # < 0.40 -> Weak evidence
-                confidence_level = "LOW"
-            
-            # UX Feature: Calculate missing important symptoms for explanation
-            missing_primary = [p for p in rules["primary"] if p not in primary_matches]
-            
-            candidates.append({
-                "disease": disease,
-                "confidence_level": confidence_level,
-                "confidence_score": confidence_score,
-                "score": confidence_score,
-                # Explanation data (for UI display - does not affect scoring)
-                "matched_primary": primary_matches,
-                "matched_supporting": supporting_matches,
-                "missing_primary": missing_primary[:3]  # Limit to top 3 for UI
-            })
+            candidates.append(self._candidate_meta(disease, rules, primary_matches,
+                                                   supporting_matches, confidence_score))
 
         # Sort by Score (Highest first)
         candidates.sort(key=lambda x: x["score"], reverse=True)
@@ -948,10 +1064,40 @@ class RulesEngine:
         # Extract top candidate metadata for return
         if top_candidates:
             top_meta = top_candidates[0]
+            top_meta["runner_up_score"] = top_candidates[1]["score"] if len(top_candidates) > 1 else None
             return allowed_names, top_meta
         else:
             return [], None
 
+    def _candidate_meta(self, disease, rules, primary_matches, supporting_matches, confidence_score):
+        """
+        Builds the candidate payload used by check_rules() and run_analysis_many().
+        """
+        # Confidence Level Mapping
+        if confidence_score >= 0.75:
+            # 0.75+ -> Strong match
+            confidence_level = "HIGH"
+        elif confidence_score >= 0.40:
+            # 0.40+ -> Decent match
+            confidence_level = "MEDIUM"
+        else:
+            # < 0.40 -> Weak evidence
+            confidence_level = "LOW"
+        
+        # UX Feature: Calculate missing important symptoms for explanation
+        missing_primary = [p for p in rules["primary"] if p not in primary_matches]
+        
+        return {
+            "disease": disease,
+            "confidence_level": confidence_level,
+            "confidence_score": confidence_score,
+            "score": confidence_score,
+            # Explanation data (for UI display - does not affect scoring)
+            "matched_primary": primary_matches,
+            "matched_supporting": supporting_matches,
+            "missing_primary": missing_primary[:3]  # Limit to top 3 for UI
+        }
+
     def get_specialist(self, disease):
         for specialist, diseases in self.specialist_map.items():
             if disease in diseases:
@@ -966,6 +1112,34 @@ class RulesEngine:
         # 0. UNIVERSAL NORMALIZATION (Industry Header)
         normalized_text = self.normalize_user_text(user_symptoms)
         
+        # Identical normalized text -> identical analysis (resubmits, view_diagnosis)
+        cached = self._analysis_cache.get(normalized_text)
+        if cached is not None:
+            return self._copy_result(cached)
+        
+        # 1-2. Emergency override / short-input fallback
+        screened = self._screen_input(user_symptoms, normalized_text)
+        if screened is not None:
+            # Short-input reason quotes the raw text, so only emergencies are cached
+            if screened["emergency"]:
+                self._analysis_cache.put(normalized_text, self._copy_result(screened))
+            return screened
+            
+        # 3. Symptom Rules Validation (Only runs if NOT emergency and NOT short input)
+        allowed_diseases, best_match_meta = self.check_rules(normalized_text)
+        result = self._rules_result(allowed_diseases, best_match_meta)
+        self._analysis_cache.put(normalized_text, self._copy_result(result))
+        return result
+
+    def _copy_result(self, result):
+        """Copies a payload so callers can't mutate cached lists."""
+        return {k: (list(v) if isinstance(v, list) else v) for k, v in result.items()}
+
+    def _screen_input(self, user_symptoms, normalized_text):
+        """
+        Checks that run before the symptom rules: red flags and vague short input.
+        Returns the final payload for those cases, or None to continue with the rules.
+        """
         # 1. Red Flags (Emergency Override) - EXECUTE FIRST
         # Emergency is always HIGH confidence (1.0)
         is_emergency, forced_spec, reason = self.check_red_flags(normalized_text)
@@ -1023,9 +1197,12 @@ class RulesEngine:
                 "allowed_diseases": [fallback_disease]
             }
             
-        # 3. Symptom Rules Validation (Only runs if NOT emergency and NOT short input)
-        allowed_diseases, best_match_meta = self.check_rules(normalized_text)
-        
+        return None
+
+    def _rules_result(self, allowed_diseases, best_match_meta):
+        """
+        Builds the run_analysis() payload from check_rules() output.
+        """
         # 4. Fallback (No Match Found)
         if not allowed_diseases or not best_match_meta:
             fallback_disease = "General Physician Consultation"
@@ -1051,6 +1228,9 @@ class RulesEngine:
         best_disease = allowed_diseases[0]
         confidence_level = best_match_meta["confidence_level"]
         confidence_score = best_match_meta["confidence_score"]
+        # Lead of the top candidate over the second one (None if only one is allowed)
+        runner_up_score = best_match_meta.get("runner_up_score")
+        score_margin = best_match_meta["score"] - runner_up_score if runner_up_score is not None else None
         
         return {
             "disease": best_disease,
@@ -1064,6 +1244,7 @@ class RulesEngine:
             "block_prediction": False,
             "emergency": False,
             "allowed_diseases": allowed_diseases,
+            "score_margin": score_margin,
             
             # UX Feature: Explanation data for "Why this diagnosis?" panel
             "matched_primary": best_match_meta.get("matched_primary", []),
@@ -1071,6 +1252,149 @@ class RulesEngine:
             "missing_primary": best_match_meta.get("missing_primary", [])
         }
 
+    def _get_batch_tables(self):
+        """
+        Builds (once) the count matrices used to score many texts at once.
+        Rows are canonical terms / exclusion terms, columns follow disease_rules order.
+        """
+        if self._batch_tables is None:
+            diseases = list(self.disease_rules)
+            terms = list(self._term_index)
+            term_col = {term: j for j, term in enumerate(terms)}
+            exclusions = list(dict.fromkeys(excl for rules in self.disease_rules.values()
+                                            for excl in rules["exclusions"]))
+            excl_col = {excl: j for j, excl in enumerate(exclusions)}
+
+            primary = np.zeros((len(terms), len(diseases)), dtype=np.int64)
+            supporting = np.zeros((len(terms), len(diseases)), dtype=np.int64)
+            excluded = np.zeros((len(exclusions), len(diseases)), dtype=np.int64)
+            for d, disease in enumerate(diseases):
+                rules = self.disease_rules[disease]
+                for p in rules["primary"]:
+                    primary[term_col[p], d] += 1
+                for s in rules["supporting"]:
+                    supporting[term_col[s], d] += 1
+                for excl in rules["exclusions"]:
+                    excluded[excl_col[excl], d] = 1
+
+            self._batch_tables = {
+                "diseases": diseases,
+                "terms": terms,
+                "needles": [(needle, term_col[term]) for needle, term in self._term_needles],
+                "exclusions": exclusions,
+                "primary": primary,
+                "supporting": supporting,
+                "excluded": excluded,
+                "primary_totals": primary.sum(axis=0).astype(np.float64),
+                "supporting_totals": supporting.sum(axis=0).astype(np.float64),
+            }
+        return self._batch_tables
+
+    def check_rules_many(self, normalized_texts):
+        """
+        Vectorized check_rules() over already-normalized texts.
+        Builds a (texts x terms) presence matrix and scores every disease with
+        one matrix product. Returns a list of (allowed_names, top_meta) tuples.
+        """
+        tables = self._get_batch_tables()
+        texts = [self.normalize_text(t) for t in normalized_texts]
+        n_texts = len(texts)
+        if n_texts == 0:
+            return []
+
+        # 1. Presence matrices (a term counts if it or any of its aliases appears)
+        present = np.zeros((n_texts, len(tables["terms"])), dtype=np.int64)
+        excl_present = np.zeros((n_texts, len(tables["exclusions"])), dtype=np.int64)
+        for i, text in enumerate(texts):
+            cols = list({j for needle, j in tables["needles"] if needle in text})
+            present[i, cols] = 1
+            excl_present[i] = [excl in text for excl in tables["exclusions"]]
+
+        # 2. Match counts per (text, disease)
+        primary_counts = present @ tables["primary"]
+        supporting_counts = present @ tables["supporting"]
+        is_excluded = (excl_present @ tables["excluded"]) > 0
+
+        # 3. Weighted score (same float operations as check_rules)
+        p_totals, s_totals = tables["primary_totals"], tables["supporting_totals"]
+        p_ratio = np.divide(primary_counts, p_totals, out=np.zeros(primary_counts.shape), where=p_totals > 0)
+        s_ratio = np.divide(supporting_counts, s_totals, out=np.zeros(supporting_counts.shape), where=s_totals > 0)
+        scores = (p_ratio * 0.7) + (s_ratio * 0.3)
+
+        # 4. Acceptance criteria: >= 1 primary OR >= 2 supporting, and not excluded
+        accepted = ((primary_counts > 0) | (supporting_counts >= 2)) & ~is_excluded
+        ranked = np.where(accepted, scores, -np.inf)
+        # Stable sort keeps rule-table order for ties, like candidates.sort()
+        order = np.argsort(-ranked, axis=1, kind="stable")[:, :2]
+
+        results = []
+        for i in range(n_texts):
+            top = [d for d in order[i] if accepted[i, d]]
+            if not top:
+                results.append(([], None))
+                continue
+            matched_terms = {tables["terms"][j] for j in np.flatnonzero(present[i])}
+            d = top[0]
+            disease = tables["diseases"][d]
+            rules = self.disease_rules[disease]
+            top_meta = self._candidate_meta(
+                disease, rules,
+                [p for p in rules["primary"] if p in matched_terms],
+                [s for s in rules["supporting"] if s in matched_terms],
+                float(scores[i, d]),
+            )
+            top_meta["runner_up_score"] = float(scores[i, top[1]]) if len(top) > 1 else None
+            results.append(([tables["diseases"][d] for d in top], top_meta))
+        return results
+
+    def run_analysis_many(self, texts, ages=None, genders=None, processes=None, chunk_size=2000):
+        """
+        Batch version of run_analysis() (+ apply_demographic_context when ages/genders
+        are given) for re-scoring history or QA corpora.
+        
+        Args:
+            texts: list / pandas Series of symptom strings
+            ages, genders: optional sequences aligned with texts (None/NaN = not provided)
+            processes: if set and the input is larger than chunk_size, chunks are
+                       scored in a process pool of this size
+            
+        Returns:
+            List of result dicts, same shape and values as run_analysis()
+        """
+        texts = list(texts)
+        ages = list(ages) if ages is not None else [None] * len(texts)
+        genders = list(genders) if genders is not None else [None] * len(texts)
+        if not (len(texts) == len(ages) == len(genders)):
+            raise ValueError("texts, ages and genders must have the same length")
+
+        if processes and len(texts) > chunk_size:
+            chunks = [(texts[i:i + chunk_size], ages[i:i + chunk_size], genders[i:i + chunk_size])
+                      for i in range(0, len(texts), chunk_size)]
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                parts = pool.map(self.run_analysis_many, *zip(*chunks))
+                return [result for part in parts for result in part]
+
+        # 0-2. Normalize and screen each text; collect the ones that need the rules
+        results = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            normalized_text = self.normalize_user_text(text)
+            results[i] = self._screen_input(text, normalized_text)
+            if results[i] is None:
+                pending.append((i, normalized_text))
+
+        # 3. Score all remaining texts in one pass
+        rule_outputs = self.check_rules_many([normalized_text for _, normalized_text in pending])
+        for (i, _), (allowed_diseases, best_match_meta) in zip(pending, rule_outputs):
+            results[i] = self._rules_result(allowed_diseases, best_match_meta)
+
+        # 4. Demographic post-processing (skips rows without age/gender)
+        for i, (age, gender) in enumerate(zip(ages, genders)):
+            age = None if age is None or (isinstance(age, float) and age != age) else age
+            gender = gender if isinstance(gender, str) and gender.strip() else None
+            results[i] = self.apply_demographic_context(results[i], age=age, gender=gender)
+        return results
+
     def apply_demographic_context(self, analysis_result, age=None, gender=None):
         """
         POST-PROCESSING ONLY: Adjusts confidence score based on age/gender context.
@@ -93,6 +93,8 @@ CREATE TABLE IF NOT EXISTS symptoms_logs (
     recommended_specialist VARCHAR(100),
     patient_age INT,
     patient_gender VARCHAR(10),
+    analysis JSONB, -- stored rules result (confidence, reason, explanation, doctors, lists)
+    report_status VARCHAR(20) DEFAULT 'pending', -- PDF rendered lazily: pending / ready / failed
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -116,3 +118,20 @@ CREATE TABLE IF NOT EXISTS activity_logs (
     details TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- 9. Geocoding Cache (utils.geocode_address; NULL lat/lng = "no result")
+CREATE TABLE IF NOT EXISTS geocode_cache (
+    query_key TEXT PRIMARY KEY,
+    lat DOUBLE PRECISION,
+    lng DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ==========================================
+-- Upgrades for existing databases (safe to re-run)
+-- ==========================================
+ALTER TABLE symptoms_logs ADD COLUMN IF NOT EXISTS analysis JSONB;
+ALTER TABLE symptoms_logs ADD COLUMN IF NOT EXISTS report_status VARCHAR(20) DEFAULT 'pending';
+
+-- Nearest-doctor search (bounding-box prefilter in utils.nearest_doctors)
+CREATE INDEX IF NOT EXISTS idx_doctors_lat_lng ON doctors (lat, lng);
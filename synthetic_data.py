@@ -0,0 +1,44 @@
+# synthetic_data.py
+# Synthetic symptom sentences for training the classifiers (train_model.py, train_linear.py).
+# Kept free of torch / transformers so the lightweight trainer can use it.
+
+import random
+import pandas as pd
+
+def generate_synthetic_data(df, samples_per_disease=50):
+    """
+    Generates synthetic text data from the symptoms dataframe.
+    """
+    synthetic_rows = []
+    symptom_cols = [col for col in df.columns if col.startswith('Symptom_')]
+    
+    # Iterate over each disease
+    for disease, *values in df[['Disease'] + symptom_cols].itertuples(index=False, name=None):
+        # Extract valid symptoms (excluding NaNs or empty strings)
+        symptoms = [str(value).replace('_', ' ') for value in values if pd.notna(value) and str(value) != 'nan']
+        
+        if not symptoms:
+            continue
+            
+        # Generate N samples
+        for _ in range(samples_per_disease):
+            # Randomly select a subset of symptoms (between 1 and len(symptoms))
+            # We skew towards 2-5 symptoms as that's typical for a user query
+            num_symptoms = random.randint(1, min(6, len(symptoms)))
+            sampled_symptoms = random.sample(symptoms, num_symptoms)
+            
+            # Create a sentence
+            text_patterns = [
+                f"I have {', '.join(sampled_symptoms)}",
+                f"Experiencing {', '.join(sampled_symptoms)}",
+                f"My symptoms are {', '.join(sampled_symptoms)}",
+                f"Suffering from {', '.join(sampled_symptoms)}",
+                f"{', '.join(sampled_symptoms)}", # Keyword only
+                f"I feel {', '.join(sampled_symptoms)}",
+                f"Doctor I have {', '.join(sampled_symptoms)}"
+            ]
+            
+            text = random.choice(text_patterns)
+            synthetic_rows.append({"text": text, "label": disease})
+            
+    return pd.DataFrame(synthetic_rows)
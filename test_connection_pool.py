@@ -0,0 +1,85 @@
+"""
+ConnectionPool: a connection leaked by a route that raised (proxy freed by the
+garbage collector, possibly while the pool's lock is held) must come back
+without deadlocking. No database needed.
+
+    python -m pytest -q test_connection_pool.py    (or: python test_connection_pool.py)
+"""
+import gc
+import threading
+
+import psycopg2.extensions
+
+import database
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+def leak_in_cycle(pool):
+    """Checks out a connection the way a failing route does: never closed, only reachable from a reference cycle."""
+    conn = pool.getconn()
+    conn._conn.in_transaction = True
+    cycle = {"conn": conn}
+    cycle["self"] = cycle  # Like a traceback -> frame -> locals cycle
+    return conn._conn
+
+
+def test_gc_under_pool_lock_does_not_deadlock():
+    connections = []
+    pool = database.ConnectionPool(maxconn=1, timeout=1, connect=lambda: connections.append(FakeConnection()) or connections[-1])
+
+    def collect_while_locked():
+        with pool._lock:
+            gc.collect()
+
+    gc.disable()  # The collection must happen below, with the lock held
+    try:
+        leaked = leak_in_cycle(pool)
+        worker = threading.Thread(target=collect_while_locked, daemon=True)
+        worker.start()
+        worker.join(5)
+    finally:
+        gc.enable()
+    assert not worker.is_alive(), "garbage collection deadlocked on the pool lock"
+
+    # The only slot comes back, rolled back, as the same connection
+    conn = pool.getconn()
+    assert conn._conn is leaked
+    assert leaked.rollbacks == 1 and not leaked.in_transaction
+    assert len(connections) == 1
+    conn.close()
+    assert pool.stats()["idle"] == 1
+
+
+def test_closed_connection_is_not_reclaimed_twice():
+    pool = database.ConnectionPool(maxconn=1, timeout=1, connect=FakeConnection)
+    conn = pool.getconn()
+    conn.close()
+    del conn
+    gc.collect()
+    assert len(pool._orphans) == 0
+    pool.getconn().close()
+    assert pool.stats()["idle"] == 1
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main(["-q", __file__]))
@@ -0,0 +1,39 @@
+"""
+utils.distances_km against the scalar utils.distance_km it replaces in
+process_doctors_data: same 0.1 km values (a last-bit trig difference may move
+a value sitting exactly on a rounding boundary by one step), same sentinels.
+
+    python -m pytest -q test_distances.py    (or: python test_distances.py)
+"""
+import random
+
+import numpy as np
+
+import utils
+
+
+def test_matches_scalar_distance_km():
+    rng = random.Random(0)
+    origin = (28.6139, 77.2090)
+    lats = [rng.uniform(-60, 60) for _ in range(20000)]
+    lngs = [rng.uniform(-180, 180) for _ in range(20000)]
+
+    distances, order = utils.distances_km(*origin, lats, lngs)
+    expected = np.array([utils.distance_km(*origin, a, b) for a, b in zip(lats, lngs)])
+
+    assert np.abs(distances - expected).max() <= 0.1 + 1e-9
+    assert np.mean(distances == expected) > 0.999
+    assert list(distances[order]) == sorted(distances)
+
+
+def test_missing_coordinates_get_the_sentinel():
+    distances, order = utils.distances_km(19.076, 72.8777, [18.52, None, "bad", 28.61], [73.85, 72.0, 1.0, None])
+    assert distances[0] == utils.distance_km(19.076, 72.8777, 18.52, 73.85)
+    assert list(distances[1:]) == [9999.0, 9999.0, 9999.0]
+    assert list(order) == [0, 1, 2, 3]
+    assert list(utils.distances_km(None, 72.0, [18.52], [73.85])[0]) == [9999.0]
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main(["-q", __file__]))
@@ -0,0 +1,77 @@
+"""
+Cached and uncached predictions must agree, including on texts that
+RulesEngine.normalize_user_text rewrites (synonyms, Hinglish, punctuation).
+
+    python -m pytest -q test_prediction_cache.py    (or: python test_prediction_cache.py)
+"""
+import os
+import re
+import zlib
+
+os.environ.setdefault("MODEL_WARMUP", "lazy")
+
+import numpy as np
+
+import inference
+import main
+
+# Each pair means the same to the rules engine but not to the model
+TEXTS = [
+    "stomach ache", "stomach pain",
+    "pet phulna", "bloating",
+    "Fever, cough!", "fever cough",
+    "sar dard", "headache",
+    "khansi aur bukhar", "cough and fever",
+    "I have  FEVER\tand cough", "i have fever and cough",
+    "vomitting", "vomiting",
+]
+
+
+class TokenHashClassifier:
+    """Stand-in for the BERT model: uncased, whitespace-insensitive, sees every word and punctuation mark."""
+    name = "token-hash"
+
+    def __init__(self, num_labels):
+        self.num_labels = num_labels
+
+    def predict_logits(self, texts):
+        logits = np.zeros((len(texts), self.num_labels), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = re.findall(r"\w+|[^\w\s]", text.lower())
+            logits[row, zlib.crc32(" ".join(tokens).encode()) % self.num_labels] = 1.0
+        return logits
+
+    def predict(self, texts):
+        return self.predict_logits(texts).argmax(axis=1)
+
+
+def predictions(monkeypatch, cache_size, texts):
+    encoder = main.le.get()
+    model = TokenHashClassifier(len(encoder.classes_))
+    monkeypatch.setattr(main, "classifier", inference.LazyResource("classifier", lambda: model))
+    monkeypatch.setattr(main, "prediction_cache", inference.PredictionCache(maxsize=cache_size, namespace="test"))
+    return [main.get_predicted_value(text) for text in texts]
+
+
+def test_normalizer_rewrites_these_texts():
+    engine = main.rules_engine.get()
+    rewritten = [t for t in TEXTS if engine.normalize_user_text(t.lower()) != t.lower()]
+    assert len(rewritten) >= len(TEXTS) // 2
+
+
+def test_cached_predictions_match_uncached(monkeypatch):
+    uncached = predictions(monkeypatch, 0, TEXTS)
+    # Both orders, twice: the first text of a pair must never answer for the second
+    for texts in (TEXTS + TEXTS, TEXTS[::-1] + TEXTS[::-1]):
+        expected = {text: label for text, label in zip(TEXTS, uncached)}
+        assert predictions(monkeypatch, 2048, texts) == [expected[t] for t in texts]
+
+
+def test_key_folds_only_case_and_whitespace():
+    assert inference.canonical_text("  I have  FEVER\tand\ncough ") == "i have fever and cough"
+    assert inference.canonical_text("fever, cough") != inference.canonical_text("fever cough")
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main(["-q", __file__]))
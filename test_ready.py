@@ -0,0 +1,43 @@
+"""
+GET /ready with MODEL_WARMUP=lazy: the probe itself must load the rules engine,
+otherwise it answers 503 until a /predict that it keeps away arrives.
+
+    MODEL_WARMUP=lazy python -m pytest -q test_ready.py    (or: python test_ready.py)
+"""
+import os
+
+os.environ.setdefault("MODEL_WARMUP", "lazy")
+
+import inference
+import main
+from rules_engine import RulesEngine
+
+
+def test_ready_loads_rules_engine_in_lazy_mode(monkeypatch):
+    assert main.MODEL_WARMUP == "lazy"
+    monkeypatch.setattr(main, "rules_engine", inference.LazyResource("rules_engine", RulesEngine))
+    monkeypatch.setattr(main, "classifier", inference.LazyResource("classifier", lambda: None))
+    monkeypatch.setattr(main, "le", inference.LazyResource("label_encoder", lambda: None))
+
+    response = main.app.test_client().get("/ready")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["ready"] and body["components"]["rules_engine"]["state"] == "ready"
+    # Only the rules engine: the ML models stay lazy
+    assert body["components"]["classifier"]["state"] == "not_loaded"
+    assert not body["ml_ready"]
+
+
+def test_ready_is_503_when_rules_engine_fails(monkeypatch):
+    def broken():
+        raise RuntimeError("rules file corrupt")
+
+    monkeypatch.setattr(main, "rules_engine", inference.LazyResource("rules_engine", broken))
+    response = main.app.test_client().get("/ready")
+    assert response.status_code == 503
+    assert response.get_json()["components"]["rules_engine"]["state"] == "unavailable"
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main(["-q", __file__]))
@@ -0,0 +1,181 @@
+"""
+Trains the lightweight classifier behind INFERENCE_BACKEND=linear: hashed word
+n-grams -> sublinear TF-IDF -> linear SVM, distilled from the BERT model.
+
+    python train_linear.py                  # labels from medical_bert_model (torch or onnx teacher)
+    python train_linear.py --no-distill     # labels from the synthetic data itself (no torch needed)
+    python train_linear.py --no-distill --compare-teacher   # ...but still report agreement with BERT
+
+The result (linear_model.pkl, about 0.5 MB) needs only numpy + scikit-learn at runtime,
+so deployments without torch still get a model signal. When a teacher is loaded
+the script reports agreement with the BERT model and per-text latency, and
+refuses to save a model that agrees less than --min-agreement.
+"""
+import argparse
+import os
+import pickle
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVC
+
+import inference
+from export_onnx import parity_texts
+from synthetic_data import generate_synthetic_data
+
+DATA_PATH = "symptoms_df_clean.csv"
+N_FEATURES = 2 ** 18
+NGRAM_RANGE = (1, 2)
+
+
+def build_pipeline(c=1.0):
+    return make_pipeline(
+        HashingVectorizer(n_features=N_FEATURES, ngram_range=NGRAM_RANGE, alternate_sign=False, norm=None),
+        TfidfTransformer(sublinear_tf=True),
+        LinearSVC(C=c)
+    )
+
+
+def export_artifact(pipeline, train_texts, num_labels, metadata):
+    """
+    Keeps only the hash buckets that occur in the training texts (every other
+    bucket has zero weight) with their idf and weight rows; inference.LinearClassifier
+    scores from these arrays directly.
+    """
+    vectorizer, tfidf, model = pipeline.steps[0][1], pipeline.steps[1][1], pipeline.steps[2][1]
+    counts = vectorizer.transform(train_texts)
+    features = np.unique(counts.indices)
+    coef = model.coef_
+    if coef.shape[0] == 1:  # Binary: one weight row for the positive class
+        coef = np.vstack([-coef, coef])
+    intercept = model.intercept_ if len(model.intercept_) == coef.shape[0] else np.concatenate([-model.intercept_, model.intercept_])
+    return {
+        "n_features": N_FEATURES,
+        "ngram_range": NGRAM_RANGE,
+        "features": features.astype(np.int32),
+        "idf": tfidf.idf_[features].astype(np.float32),
+        # smooth_idf value of a bucket never seen in training
+        "default_idf": float(np.log((1 + counts.shape[0]) / 1) + 1),
+        "coef": np.ascontiguousarray(coef[:, features].T, dtype=np.float32),
+        "intercept": np.asarray(intercept, dtype=np.float32),
+        "classes": np.asarray(model.classes_, dtype=np.int64),
+        "num_labels": num_labels,
+        "metadata": metadata
+    }
+
+
+def predict_in_batches(classifier, texts, batch_size=64):
+    return np.concatenate([classifier.predict(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+
+
+def per_text_latency_us(classifier, texts):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        classifier.predict_logits([text])
+        timings.append(time.perf_counter() - start)
+    return 1e6 * np.median(timings), 1e6 * np.percentile(timings, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train / distil the hashed n-gram linear classifier.")
+    parser.add_argument("--model-path", default=os.environ.get("MODEL_PATH", "medical_bert_model"), help="BERT teacher")
+    parser.add_argument("--teacher-backend", default="onnx" if os.environ.get("INFERENCE_BACKEND") == "onnx" else "torch")
+    parser.add_argument("--no-distill", action="store_true", help="train on synthetic labels instead of the teacher's")
+    parser.add_argument("--compare-teacher", action="store_true", help="with --no-distill, still load the teacher to report agreement")
+    parser.add_argument("--label-encoder", default="label_encoder.pkl")
+    parser.add_argument("--output", default=inference.LINEAR_FILENAME)
+    parser.add_argument("--samples-per-disease", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--c", type=float, default=1.0, help="LinearSVC regularization")
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="don't save below this agreement with the teacher")
+    args = parser.parse_args()
+
+    with open(args.label_encoder, 'rb') as f:
+        le = pickle.load(f)
+
+    print("🔄 Generating synthetic training data")
+    random.seed(args.seed)
+    data = generate_synthetic_data(pd.read_csv(DATA_PATH), samples_per_disease=args.samples_per_disease)
+    data = data[data['label'].isin(le.classes_)]
+    texts = data['text'].tolist()
+    truth = le.transform(data['label'])
+    print(f"   {len(texts)} texts, {len(le.classes_)} diseases")
+
+    # --no-distill never touches the teacher (no torch / HF download) unless asked to compare
+    teacher = None
+    if not args.no_distill or args.compare_teacher:
+        teacher = inference.load_classifier(args.teacher_backend, args.model_path)
+    distill = teacher is not None and not args.no_distill
+    if teacher is None and not args.no_distill:
+        print("⚠️ Teacher model unavailable, training on synthetic labels instead.")
+    if teacher is not None:
+        print(f"🔄 Labelling with the {teacher.name} teacher")
+        teacher_labels = predict_in_batches(teacher, texts)
+    labels = teacher_labels if distill else truth
+
+    train_idx, test_idx = train_test_split(np.arange(len(texts)), test_size=0.1, random_state=42)
+    train_texts = [texts[i] for i in train_idx]
+    test_texts = [texts[i] for i in test_idx]
+
+    print("🔄 Training")
+    start = time.perf_counter()
+    pipeline = build_pipeline(args.c)
+    pipeline.fit(train_texts, labels[train_idx])
+    print(f"   Fitted in {time.perf_counter() - start:.1f}s")
+
+    metadata = {
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "distilled_from": f"{args.teacher_backend}:{args.model_path}" if distill else None,
+        "samples_per_disease": args.samples_per_disease,
+        "seed": args.seed,
+        "sklearn": sklearn.__version__
+    }
+    artifact = export_artifact(pipeline, train_texts, len(le.classes_), metadata)
+    tmp_path = args.output + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(artifact, f)
+    linear = inference.LinearClassifier(tmp_path)
+
+    # The compact artifact must score exactly like the sklearn pipeline
+    diff = np.abs(linear.predict_logits(test_texts)[:, artifact["classes"]] - pipeline.decision_function(test_texts)).max()
+    predicted = linear.predict(test_texts)
+    median_us, p95_us = per_text_latency_us(linear, test_texts[:1000])
+
+    print("📊 Held-out synthetic texts")
+    print(f"   Accuracy (synthetic labels): linear {np.mean(predicted == truth[test_idx]) * 100:.2f}%"
+          + (f", teacher {np.mean(teacher_labels[test_idx] == truth[test_idx]) * 100:.2f}%" if teacher is not None else ""))
+    print(f"   Artifact vs pipeline:        max |score diff| {diff:.2e}")
+    print(f"   Latency per text:            linear {median_us:.0f} µs median, {p95_us:.0f} µs p95")
+    print(f"   Artifact size:               {os.path.getsize(tmp_path) / 1e6:.2f} MB")
+
+    agreement = None
+    if teacher is not None:
+        parity = parity_texts(1000, seed=args.seed + 1)
+        agreement = float(np.mean(predicted == teacher_labels[test_idx]))
+        parity_agreement = float(np.mean(linear.predict(parity) == predict_in_batches(teacher, parity)))
+        teacher_us, _ = per_text_latency_us(teacher, test_texts[:200])
+        print(f"   Agreement with teacher:      {agreement * 100:.2f}% held-out, {parity_agreement * 100:.2f}% on parity texts")
+        print(f"   Teacher latency per text:    {teacher_us:.0f} µs median ({teacher_us / median_us:.0f}x slower)")
+        artifact["metadata"].update({"agreement": agreement, "parity_agreement": parity_agreement})
+
+    if agreement is not None and agreement < args.min_agreement:
+        os.remove(tmp_path)
+        print(f"❌ Agreement below {args.min_agreement * 100:.1f}%, model not saved.")
+        sys.exit(1)
+
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(artifact, f)
+    os.replace(tmp_path, args.output)
+    print(f"✅ Saved {args.output}. Set INFERENCE_BACKEND=linear to use it.")
+
+
+if __name__ == "__main__":
+    main()
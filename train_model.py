@@ -3,108 +3,220 @@ import numpy as np
 import torch
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, Trainer, TrainingArguments
-from torch.utils.data import Dataset
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, Trainer, TrainingArguments, DataCollatorWithPadding
+from torch.utils.data import Dataset, DataLoader, Sampler
+import argparse
+import hashlib
+import json
 import pickle
 import os
 import random
 
+from synthetic_data import generate_synthetic_data
+
 # Configuration
 MODEL_NAME = "distilbert-base-uncased"
 DATA_PATH = "symptoms_df_clean.csv" # NEW Clean Dataset
 OUTPUT_DIR = "medical_bert_output"
 MODEL_SAVE_PATH = "medical_bert_model"
 SAMPLES_PER_DISEASE = 100 # Augmenting data: 41 * 100 = 4100 examples
+MAX_LENGTH = 64
+SEED = 42
+CORPUS_DIR = "medical_bert_corpus" # Pre-tokenized memmaps, see prepare_corpus()
+CORPUS_VERSION = 1 # Bump when the synthetic text generation changes
 
-def generate_synthetic_data(df, samples_per_disease=50):
+class DiseaseDataset(Dataset):
     """
-    Generates synthetic text data from the symptoms dataframe.
+    One split of the prepared corpus, read straight from the memmapped .npy files.
+    Items are unpadded (cut to their own length); DataCollatorWithPadding pads each
+    batch to its longest item.
     """
-    synthetic_rows = []
-    
-    # Iterate over each disease
-    for index, row in df.iterrows():
-        disease = row['Disease']
-        # Extract valid symptoms (excluding NaNs or empty strings)
-        symptoms = [str(row[col]).replace('_', ' ') for col in df.columns if col.startswith('Symptom_') and pd.notna(row[col]) and str(row[col]) != 'nan']
-        
-        if not symptoms:
-            continue
-            
-        # Generate N samples
-        for _ in range(samples_per_disease):
-            # Randomly select a subset of symptoms (between 1 and len(symptoms))
-            # We skew towards 2-5 symptoms as that's typical for a user query
-            num_symptoms = random.randint(1, min(6, len(symptoms)))
-            sampled_symptoms = random.sample(symptoms, num_symptoms)
-            
-            # Create a sentence
-            text_patterns = [
-                f"I have {', '.join(sampled_symptoms)}",
-                f"Experiencing {', '.join(sampled_symptoms)}",
-                f"My symptoms are {', '.join(sampled_symptoms)}",
-                f"Suffering from {', '.join(sampled_symptoms)}",
-                f"{', '.join(sampled_symptoms)}", # Keyword only
-                f"I feel {', '.join(sampled_symptoms)}",
-                f"Doctor I have {', '.join(sampled_symptoms)}"
-            ]
-            
-            text = random.choice(text_patterns)
-            synthetic_rows.append({"text": text, "label": disease})
-            
-    return pd.DataFrame(synthetic_rows)
-
-class DiseaseDataset(Dataset):
-    def __init__(self, encodings, labels):
-        self.encodings = encodings
-        self.labels = labels
+    def __init__(self, corpus_dir, split):
+        self.input_ids = np.load(os.path.join(corpus_dir, f"{split}_input_ids.npy"), mmap_mode='r')
+        self.attention_mask = np.load(os.path.join(corpus_dir, f"{split}_attention_mask.npy"), mmap_mode='r')
+        self.lengths = np.load(os.path.join(corpus_dir, f"{split}_lengths.npy"))
+        self.labels = np.load(os.path.join(corpus_dir, f"{split}_labels.npy"), mmap_mode='r')
 
     def __getitem__(self, idx):
-        item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
-        item['labels'] = torch.tensor(self.labels[idx])
-        return item
+        length = int(self.lengths[idx])
+        return {
+            'input_ids': torch.from_numpy(self.input_ids[idx, :length].astype(np.int64)),
+            'attention_mask': torch.from_numpy(self.attention_mask[idx, :length].astype(np.int64)),
+            'labels': torch.tensor(int(self.labels[idx]))
+        }
 
     def __len__(self):
         return len(self.labels)
 
-def train():
-    print(f"Using device: {'cuda' if torch.cuda.is_available() else 'cpu'}")
-    
-    if not os.path.exists(DATA_PATH):
-        print(f"Error: {DATA_PATH} not found!")
-        return
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler that keeps batches random but similar in length: indices are
+    shuffled, cut into pools of `batch_size * pool_batches`, each pool is sorted
+    by length and split into batches, and the batches are shuffled again.
+    Reshuffles every epoch.
+    """
+    def __init__(self, lengths, batch_size, seed=SEED, pool_batches=50):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        indices = rng.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(indices), self.pool_size):
+            pool = indices[start:start + self.pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batches.extend(pool[i:i + self.batch_size].tolist() for i in range(0, len(pool), self.batch_size))
+        for i in rng.permutation(len(batches)):
+            yield batches[i]
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+class BucketedTrainer(Trainer):
+    """Trainer whose training batches come from LengthBucketSampler."""
+    def get_train_dataloader(self):
+        sampler = LengthBucketSampler(self.train_dataset.lengths, self.args.train_batch_size, seed=self.args.seed)
+        loader = DataLoader(
+            self.train_dataset,
+            batch_sampler=sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory
+        )
+        return self.accelerator.prepare(loader)
+
+def _file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def corpus_settings(tokenizer_name=MODEL_NAME, seed=SEED):
+    """Everything the prepared corpus depends on; a mismatch means it must be rebuilt."""
+    return {
+        "version": CORPUS_VERSION,
+        "data_sha1": _file_sha1(DATA_PATH),
+        "tokenizer": tokenizer_name,
+        "max_length": MAX_LENGTH,
+        "samples_per_disease": SAMPLES_PER_DISEASE,
+        "seed": seed,
+        "test_size": 0.1
+    }
+
+def load_manifest(corpus_dir):
+    path = os.path.join(corpus_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_split(corpus_dir, split, texts, labels, tokenizer, chunk_size=1024):
+    """Tokenizes `texts` chunk by chunk into fixed-width memmaps; returns the split's manifest entry."""
+    ids_dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.int32
+    input_ids = np.lib.format.open_memmap(
+        os.path.join(corpus_dir, f"{split}_input_ids.npy"), mode='w+', dtype=ids_dtype, shape=(len(texts), MAX_LENGTH)
+    )
+    attention_mask = np.lib.format.open_memmap(
+        os.path.join(corpus_dir, f"{split}_attention_mask.npy"), mode='w+', dtype=np.uint8, shape=(len(texts), MAX_LENGTH)
+    )
+    lengths = np.zeros(len(texts), dtype=np.int16)
+    for start in range(0, len(texts), chunk_size):
+        encodings = tokenizer(
+            texts[start:start + chunk_size], truncation=True, padding='max_length', max_length=MAX_LENGTH
+        )
+        end = start + len(encodings['input_ids'])
+        input_ids[start:end] = encodings['input_ids']
+        attention_mask[start:end] = encodings['attention_mask']
+        lengths[start:end] = np.asarray(encodings['attention_mask']).sum(axis=1)
+    input_ids.flush()
+    attention_mask.flush()
+    np.save(os.path.join(corpus_dir, f"{split}_lengths.npy"), lengths)
+    np.save(os.path.join(corpus_dir, f"{split}_labels.npy"), np.asarray(labels, dtype=np.int16))
+    return {"rows": len(texts), "width": int(lengths.max()) if len(lengths) else 0, "ids_dtype": np.dtype(ids_dtype).name}
+
+def prepare_corpus(corpus_dir=CORPUS_DIR, tokenizer_name=MODEL_NAME, seed=SEED, force=False):
+    """
+    Generates the synthetic training texts, tokenizes them once and writes
+    <split>_input_ids / _attention_mask / _lengths / _labels .npy files plus
+    manifest.json and label_encoder.pkl to `corpus_dir`.
+    Skipped when the existing manifest already matches the current settings.
+    """
+    settings = corpus_settings(tokenizer_name, seed)
+    manifest = load_manifest(corpus_dir)
+    if not force and manifest and manifest["settings"] == settings:
+        print(f"Corpus in {corpus_dir} is up to date ({manifest['splits']['train']['rows']} train rows).")
+        return manifest
 
     print("Loading clean data...")
     df = pd.read_csv(DATA_PATH)
     
     print("Generating synthetic data for training...")
+    random.seed(seed)
     train_df = generate_synthetic_data(df, samples_per_disease=SAMPLES_PER_DISEASE)
     print(f"Generated {len(train_df)} training examples.")
     
     # Label Encoding
     le = LabelEncoder()
     train_df['label_id'] = le.fit_transform(train_df['label'])
+
+    # Split Data
+    train_texts, val_texts, train_labels, val_labels = train_test_split(
+        train_df['text'].tolist(), train_df['label_id'].tolist(), test_size=settings["test_size"], random_state=42
+    )
+    
+    print("Tokenizing...")
+    os.makedirs(corpus_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    splits = {
+        "train": _write_split(corpus_dir, "train", train_texts, train_labels, tokenizer),
+        "val": _write_split(corpus_dir, "val", val_texts, val_labels, tokenizer)
+    }
+    with open(os.path.join(corpus_dir, "label_encoder.pkl"), 'wb') as f:
+        pickle.dump(le, f)
+
+    manifest = {
+        "settings": settings,
+        "tokenizer_vocab_size": len(tokenizer),
+        "num_labels": len(le.classes_),
+        "splits": splits
+    }
+    # Manifest last: a half-written corpus never looks valid
+    with open(os.path.join(corpus_dir, "manifest.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Corpus saved to {os.path.abspath(corpus_dir)}")
+    return manifest
+
+def train(corpus_dir=CORPUS_DIR, seed=SEED, rebuild_corpus=False):
+    print(f"Using device: {'cuda' if torch.cuda.is_available() else 'cpu'}")
     
+    if not os.path.exists(DATA_PATH):
+        print(f"Error: {DATA_PATH} not found!")
+        return
+
+    manifest = prepare_corpus(corpus_dir, MODEL_NAME, seed, force=rebuild_corpus)
+
     # Save Label Encoder
+    with open(os.path.join(corpus_dir, "label_encoder.pkl"), 'rb') as f:
+        le = pickle.load(f)
     with open('label_encoder.pkl', 'wb') as f:
         pickle.dump(le, f)
     print("Label encoder saved.")
-
-    # Split Data
-    train_texts, val_texts, train_labels, val_labels = train_test_split(
-        train_df['text'].tolist(), train_df['label_id'].tolist(), test_size=0.1, random_state=42
-    )
     
     print("Loading Tokenizer and Model...")
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=len(le.classes_))
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=manifest["num_labels"])
     
-    print("Tokenizing...")
-    train_encodings = tokenizer(train_texts, truncation=True, padding=True, max_length=64)
-    val_encodings = tokenizer(val_texts, truncation=True, padding=True, max_length=64)
-    
-    train_dataset = DiseaseDataset(train_encodings, train_labels)
-    val_dataset = DiseaseDataset(val_encodings, val_labels)
+    train_dataset = DiseaseDataset(corpus_dir, "train")
+    val_dataset = DiseaseDataset(corpus_dir, "val")
     
     training_args = TrainingArguments(
         output_dir=OUTPUT_DIR,
@@ -121,11 +233,12 @@ def train():
         load_best_model_at_end=False,
     )
 
-    trainer = Trainer(
+    trainer = BucketedTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
+        data_collator=DataCollatorWithPadding(tokenizer),
     )
 
     print("Starting Training...")
@@ -137,4 +250,14 @@ def train():
     print(f"Model saved to {os.path.abspath(MODEL_SAVE_PATH)}")
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the symptom classifier.")
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR, help="where the pre-tokenized corpus lives")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed for synthetic data generation")
+    parser.add_argument("--prepare-only", action="store_true", help="build the corpus and stop")
+    parser.add_argument("--rebuild-corpus", action="store_true", help="regenerate even if the manifest matches")
+    args = parser.parse_args()
+
+    if args.prepare_only:
+        prepare_corpus(args.corpus_dir, MODEL_NAME, args.seed, force=args.rebuild_corpus)
+    else:
+        train(args.corpus_dir, args.seed, rebuild_corpus=args.rebuild_corpus)
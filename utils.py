@@ -1,52 +1,318 @@
 
 import requests
-from math import radians, cos, sin, asin, sqrt
+import re
+from math import radians, degrees, cos, sin, asin, sqrt
 import datetime
+import os
+import queue
+import heapq
+import threading
+import time
+import atexit
+import numpy as np
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 import database
+from gazetteer import Gazetteer
 
 # --- Geocoding (OpenStreetMap / Nominatim) ---
-def geocode_address(address, city, pincode):
+# Cache lifetimes for geocode_cache rows: hits rarely change, misses are retried sooner
+GEOCODE_CACHE_TTL = float(os.environ.get('GEOCODE_CACHE_TTL_DAYS', 90)) * 86400
+GEOCODE_NEGATIVE_TTL = float(os.environ.get('GEOCODE_NEGATIVE_TTL_HOURS', 24)) * 3600
+# GEOCODE_OFFLINE=true: never call Nominatim, use the cache + bundled gazetteer only
+GEOCODE_OFFLINE = os.environ.get('GEOCODE_OFFLINE', 'false').lower() == 'true'
+
+_gazetteer = None
+
+def get_gazetteer():
+    """Loads the offline city/pincode gazetteer on first use."""
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer(
+            os.path.dirname(os.path.abspath(__file__)),
+            pincodes_path=os.environ.get('GAZETTEER_PINCODES_CSV')
+        )
+    return _gazetteer
+
+def normalize_geocode_query(q):
+    """Cache key for a query: lowercase, punctuation dropped, whitespace collapsed."""
+    return " ".join(re.sub(r"[^\w\s]", " ", str(q).lower()).split())
+
+def _geocode_cache_lookup(keys):
     """
-    Geocodes an address using OpenStreetMap's Nominatim API.
-    Returns (lat, lng) as floats, or (None, None) if not found.
-    Tries multiple query formats to maximize hit rate.
+    Returns {key: (lat, lng)} for fresh cache rows; misses are stored as (None, None).
+    Cache problems are logged and treated as "not cached".
     """
-    queries = [
-        f"{address}, {city}, {pincode}",
-        f"{city}, {pincode}",
-        f"{city}"
-    ]
-    
+    try:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT query_key, lat, lng FROM geocode_cache
+                WHERE query_key = ANY(%s)
+                  AND updated_at > CURRENT_TIMESTAMP -
+                      (CASE WHEN lat IS NULL THEN %s ELSE %s END) * INTERVAL '1 second'
+                """,
+                (list(keys), GEOCODE_NEGATIVE_TTL, GEOCODE_CACHE_TTL)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.commit()
+        return {key: (lat, lng) for key, lat, lng in rows}
+    except Exception as e:
+        print(f"Geocoding Cache Warning: {e}")
+        return {}
+
+def _geocode_cache_store(key, lat, lng):
+    try:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO geocode_cache (query_key, lat, lng, updated_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (query_key) DO UPDATE
+                SET lat = EXCLUDED.lat, lng = EXCLUDED.lng, updated_at = EXCLUDED.updated_at
+                """,
+                (key, lat, lng)
+            )
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        print(f"Geocoding Cache Warning: {e}")
+
+# Nominatim usage policy: at most one request per second (shared by all threads)
+NOMINATIM_MIN_INTERVAL = 1.0
+_nominatim_lock = threading.Lock()
+_nominatim_last = [0.0]
+_nominatim_requests = [0]
+
+def nominatim_request_count():
+    """Nominatim requests sent by this process (for hit-rate reporting)."""
+    return _nominatim_requests[0]
+
+def _nominatim_search(q):
     url = "https://nominatim.openstreetmap.org/search"
     headers = {
         'User-Agent': 'MediMindAI/1.0 (educational_project; contact_admin@wellsure.app)',
         'Accept-Language': 'en'
     }
+    params = {
+        'q': q,
+        'format': 'json',
+        'limit': 1
+    }
+    with _nominatim_lock:
+        wait = _nominatim_last[0] + NOMINATIM_MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _nominatim_last[0] = time.monotonic()
+        _nominatim_requests[0] += 1
+    # Add timeout to prevent hanging
+    return requests.get(url, params=params, headers=headers, timeout=5)
+
+def _geocode(address, city, pincode, network=True):
+    """geocode_address() plus a flag telling whether a network error cut the lookup short."""
+    queries = [
+        f"{address}, {city}, {pincode}",
+        f"{city}, {pincode}",
+        f"{city}"
+    ]
+    keys = [normalize_geocode_query(q) for q in queries]
+    cached = _geocode_cache_lookup(set(keys))
+
+    network_ok = network and not GEOCODE_OFFLINE
+    network_failed = False
+    for i, (q, key) in enumerate(zip(queries, keys)):
+        if i == 1:
+            # Street address not found: a local centroid beats a city-level network query
+            lat, lon = get_gazetteer().lookup(city, pincode)
+            if lat is not None:
+                return lat, lon, network_failed
+
+        if not key:
+            continue
+        if key in cached:
+            lat, lon = cached[key]
+            if lat is not None and lon is not None:
+                return float(lat), float(lon), network_failed
+            continue  # Known miss, try the next (coarser) query
+        if not network_ok:
+            continue
 
-    for q in queries:
         try:
-            params = {
-                'q': q,
-                'format': 'json',
-                'limit': 1
-            }
-            # Add timeout to prevent hanging
-            response = requests.get(url, params=params, headers=headers, timeout=5)
+            response = _nominatim_search(q)
             if response.status_code == 200:
                 data = response.json()
                 if data:
                     lat = float(data[0]['lat'])
                     lon = float(data[0]['lon'])
-                    return lat, lon
+                    _geocode_cache_store(key, lat, lon)
+                    return lat, lon, network_failed
+                _geocode_cache_store(key, None, None)
         except Exception as e:
             # Log as warning but don't crash. Network unreachable is common in free tiers.
             print(f"Geocoding Warning: Could not fetch coordinates for '{q}' ({e})")
-            
-    return None, None
+            network_ok = False
+            network_failed = True
+
+    return None, None, network_failed
+
+def geocode_address(address, city, pincode, network=True):
+    """
+    Geocodes an address using OpenStreetMap's Nominatim API.
+    Returns (lat, lng) as floats, or (None, None) if not found.
+    Tries multiple query formats to maximize hit rate.
+    Every query (full address, city + pincode, city) is cached in geocode_cache,
+    including "no result" answers, so repeated addresses and shared pincodes
+    don't hit the network. Network errors are not cached.
+    If the full address can't be resolved, the offline gazetteer (city / pincode
+    centroids) is used before any coarser network query; after one network error
+    the remaining queries are skipped.
+    network=False answers from the cache and gazetteer only (never blocks on Nominatim).
+    """
+    lat, lng, _ = _geocode(address, city, pincode, network)
+    return lat, lng
+
+def address_changed(table, row_id, address, city, pincode):
+    """
+    True unless the stored `users` / `doctors` row already has coordinates for the
+    same (normalized) address, in which case profile updates can skip geocoding.
+    """
+    if table not in ('users', 'doctors'):
+        raise ValueError(f"Unsupported table: {table}")
+    try:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT address, city, pincode, lat, lng FROM {table} WHERE id = %s", (row_id,))
+            current = cursor.fetchone()
+            cursor.close()
+            conn.commit()
+    except Exception as e:
+        print(f"Geocoding Warning: Could not load current address ({e})")
+        return True
+
+    if current and current[3] and current[4]:
+        old = normalize_geocode_query(f"{current[0] or ''}, {current[1] or ''}, {current[2] or ''}")
+        new = normalize_geocode_query(f"{address or ''}, {city or ''}, {pincode or ''}")
+        return old != new
+    return True
+
+class GeocodingQueue:
+    """
+    Background geocoding for profile saves.
+    Routes commit the profile right away (with instant cache/gazetteer coordinates
+    when available) and enqueue a job. A daemon thread resolves it through Nominatim
+    (rate-limited to 1 request/s) and writes lat/lng, only if the row still holds the
+    same address. Jobs cut short by network errors are retried `max_retries` times
+    with exponential backoff starting at `retry_delay` seconds.
+    Pending jobs live in memory; rows left without coordinates can be backfilled.
+    """
+    def __init__(self, max_retries=3, retry_delay=30.0, max_queue=1000):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_queue = max_queue
+        self.updated = 0
+        self.retried = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._queue = None
+
+    def enqueue(self, table, row_id, address, city, pincode):
+        if table not in ('users', 'doctors'):
+            raise ValueError(f"Unsupported table: {table}")
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((table, row_id, address, city, pincode, 0))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            print(f"Geocoding Warning: queue full, {table} #{row_id} not geocoded")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "updated": self.updated,
+                "retried": self.retried,
+                "dropped": self.dropped
+            }
+
+    def _ensure_started(self):
+        # (Re)start lazily: threads don't survive a gunicorn fork
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="geocoder", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        retries = []  # heap of (ready_at, seq, job)
+        seq = 0
+        while True:
+            timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+            try:
+                job = self._queue.get(timeout=timeout)
+                heapq.heappush(retries, (time.monotonic(), seq, job))
+                seq += 1
+            except queue.Empty:
+                pass
+
+            while retries and retries[0][0] <= time.monotonic():
+                _, _, job = heapq.heappop(retries)
+                try:
+                    retry = self._process(job)
+                except Exception as e:
+                    print(f"Geocoding Error: {e}")
+                    retry = None
+                if retry is not None:
+                    attempt = retry[-1]
+                    heapq.heappush(retries, (time.monotonic() + self.retry_delay * 2 ** (attempt - 1), seq, retry))
+                    seq += 1
+
+    def _process(self, job):
+        """Geocodes one job; returns the job to retry, or None."""
+        table, row_id, address, city, pincode, attempt = job
+        lat, lng, network_failed = _geocode(address, city, pincode)
+
+        if lat is not None and lng is not None:
+            with database.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""
+                    UPDATE {table} SET lat = %s, lng = %s
+                    WHERE id = %s
+                      AND address IS NOT DISTINCT FROM %s
+                      AND city IS NOT DISTINCT FROM %s
+                      AND pincode IS NOT DISTINCT FROM %s
+                    """,
+                    (lat, lng, row_id, address, city, pincode)
+                )
+                updated = cursor.rowcount
+                conn.commit()
+                cursor.close()
+            with self._lock:
+                self.updated += updated
+
+        if network_failed and attempt < self.max_retries:
+            with self._lock:
+                self.retried += 1
+            return (table, row_id, address, city, pincode, attempt + 1)
+        return None
+
+
+geocode_queue = GeocodingQueue(
+    max_retries=int(os.environ.get('GEOCODE_MAX_RETRIES', 3)),
+    retry_delay=float(os.environ.get('GEOCODE_RETRY_DELAY', 30))
+)
 
 # --- Distance Calculation (Haversine) ---
 def distance_km(lat1, lon1, lat2, lon2):
@@ -74,23 +340,174 @@ def distance_km(lat1, lon1, lat2, lon2):
         print(f"Distance Calc Error: {e}")
         return 9999.0
 
+def _coord_array(values):
+    """Floats for valid coordinates, NaN for None / unparsable values."""
+    try:
+        return np.asarray(values, dtype=float)  # None becomes NaN
+    except (TypeError, ValueError):
+        pass
+    out = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+def distances_km(lat, lng, lats, lngs, missing=9999.0):
+    """
+    Vectorized distance_km from one point to many.
+    Returns (distances, order): a float array rounded to 0.1 km like distance_km,
+    with `missing` wherever either end has no valid coordinates, and the indices
+    that sort it ascending (stable, so ties keep their input order).
+    NumPy's sin/cos may differ from math's in the last bit, so a value sitting
+    exactly on a rounding boundary can come out 0.1 km away from distance_km's.
+    """
+    lats, lngs = _coord_array(lats), _coord_array(lngs)
+    origin = _coord_array([lat, lng])
+
+    valid = ~(np.isnan(lats) | np.isnan(lngs))
+    if np.isnan(origin).any():
+        valid[:] = False
+
+    distances = np.full(len(lats), float(missing))
+    if valid.any():
+        lat1, lon1 = np.radians(origin)
+        lat2, lon2 = np.radians(lats[valid]), np.radians(lngs[valid])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        raw = 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0))) * 6371
+        # Python round() per value, like distance_km (np.round can settle halfway cases differently)
+        distances[valid] = [round(d, 1) for d in raw.tolist()]
+
+    return distances, np.argsort(distances, kind="stable")
+
 # --- Activity Logger ---
+class ActivityLogger:
+    """
+    Buffered, background writer for activity_logs.
+    Request handlers only enqueue; a daemon thread flushes every `batch_size`
+    events or `flush_interval` seconds with one multi-row INSERT.
+    When the queue is full new events are dropped (counted in `dropped`) so a
+    slow database never blocks a request. Remaining events are flushed on exit.
+    """
+    def __init__(self, batch_size=50, flush_interval=0.5, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._queue = None
+        self._stop = threading.Event()
+
+    def log(self, user_id, role, action, details=""):
+        self._ensure_started()
+        # Event time is captured now; the DB default would stamp the (later) flush time
+        event = (user_id, role, action, details, datetime.datetime.now(datetime.timezone.utc))
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                if self.dropped % 100 == 1:
+                    print(f"Logging Warning: activity queue full, {self.dropped} event(s) dropped")
+
+    def close(self, timeout=5.0):
+        """Stops the writer thread after flushing everything still queued."""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed
+            }
+
+    def _ensure_started(self):
+        # (Re)start lazily: threads don't survive a gunicorn fork
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="activity-logger", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+
+            # Collect up to batch_size events or until the flush interval elapses
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = 0 if self._stop.is_set() else deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        sql = "INSERT INTO activity_logs (user_id, role, action, details, created_at) VALUES %s"
+        try:
+            with database.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    database.execute_values(cursor, sql, batch)
+                    conn.commit()
+                    written, failed = len(batch), 0
+                except Exception as e:
+                    # One bad event must not lose the whole batch: retry row by row
+                    print(f"Logging Error (batch of {len(batch)}): {e}")
+                    conn.rollback()
+                    written = failed = 0
+                    for event in batch:
+                        try:
+                            database.execute_values(cursor, sql, [event])
+                            conn.commit()
+                            written += 1
+                        except Exception as row_e:
+                            conn.rollback()
+                            failed += 1
+                            print(f"Logging Error: {row_e}")
+                cursor.close()
+        except Exception as e:
+            written, failed = 0, len(batch)
+            print(f"Logging Error: {e}")
+        with self._lock:
+            self.written += written
+            self.failed += failed
+
+
+activity_logger = ActivityLogger(
+    batch_size=int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 50)),
+    flush_interval=int(os.environ.get('ACTIVITY_LOG_FLUSH_MS', 500)) / 1000.0,
+    max_queue=int(os.environ.get('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+)
+atexit.register(activity_logger.close)
+
 def log_activity(user_id, role, action, details=""):
     """
-    Log user activity to the database.
+    Log user activity to the database (non-blocking, see ActivityLogger).
     """
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO activity_logs (user_id, role, action, details) VALUES (%s, %s, %s, %s)",
-            (user_id, role, action, details)
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Logging Error: {e}")
+    activity_logger.log(user_id, role, action, details)
 
 # --- PDF Report Generator ---
 def generate_pdf_report(filepath, patient_name, disease, symptoms, description, medications, precautions, diets, workouts, age=None, gender=None):
@@ -185,19 +602,126 @@ def process_doctors_data(doctors_list, patient_lat, patient_lng):
     Modifies the list in-place or returns processed list.
     """
     from datetime import timedelta
-    
-    for d in doctors_list:
-        # Distance
-        if patient_lat and patient_lng and d.get('lat') and d.get('lng'):
-             d['distance'] = distance_km(patient_lat, patient_lng, d['lat'], d['lng'])
-        else:
-             d['distance'] = 99999.0
-             
+
+    # Distance (vectorized); doctors without coordinates sort last
+    distances, _ = distances_km(
+        patient_lat, patient_lng,
+        [d.get('lat') for d in doctors_list], [d.get('lng') for d in doctors_list]
+    )
+    unlocated = np.array([not (patient_lat and patient_lng and d.get('lat') and d.get('lng')) for d in doctors_list], dtype=bool)
+    distances[unlocated] = 99999.0
+
+    for d, dist in zip(doctors_list, distances.tolist()):
+        d['distance'] = dist
+
         # JSON Serialization (timedelta)
         for k, v in list(d.items()):
             if isinstance(v, timedelta):
                 d[k] = str(v)
-                
-    # Sort
-    doctors_list.sort(key=lambda x: x.get('distance', 99999.0))
+
+    # Sort (stable, same order as list.sort on distance)
+    doctors_list[:] = [doctors_list[i] for i in np.argsort(distances, kind="stable").tolist()]
     return doctors_list
+
+
+# --- Nearest Doctors (paginated) ---
+# Search radii (km) tried in order before falling back to a full scan
+NEAREST_SEARCH_RADII_KM = (25, 100, 400, 1600)
+EARTH_RADIUS_KM = 6371.0  # Same radius as _DOCTOR_DISTANCE_SQL / haversine
+
+_DOCTOR_DISTANCE_SQL = """
+    6371 * 2 * ASIN(SQRT(LEAST(1.0,
+        POWER(SIN(RADIANS(lat::float8 - %(lat)s) / 2), 2) +
+        COS(RADIANS(%(lat)s)) * COS(RADIANS(lat::float8)) *
+        POWER(SIN(RADIANS(lng::float8 - %(lng)s) / 2), 2)
+    )))
+"""
+
+def doctor_filters(specialization=None, search=None):
+    """
+    SQL condition (starting with AND, or empty) and named params for the doctor list filters:
+    exact specialization and a case-insensitive name / city substring search.
+    """
+    conditions, params = [], {}
+    if specialization:
+        conditions.append("AND specialization = %(spec)s")
+        params['spec'] = specialization
+    search = (search or "").strip()
+    if search:
+        # Escape LIKE wildcards so the search is a plain substring match
+        pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append("AND (name ILIKE %(search)s OR city ILIKE %(search)s)")
+        params['search'] = f"%{pattern}%"
+    return " ".join(conditions), params
+
+
+def _search_box(lat, radius):
+    """
+    Exact half-height / half-width (degrees) of the lat/lng box containing every point
+    within `radius` km of latitude `lat`; dlng is None when the circle reaches a pole.
+    """
+    angle = radius / EARTH_RADIUS_KM
+    dlat = degrees(angle)
+    cos_lat = cos(radians(lat))
+    if cos_lat <= 0 or sin(angle) >= cos_lat:
+        return dlat, None
+    # Tiny margin so float rounding never drops a doctor on the edge
+    return dlat + 1e-6, degrees(asin(sin(angle) / cos_lat)) + 1e-6
+
+
+def nearest_doctors(cursor, patient_lat, patient_lng, specialization=None, limit=20, offset=0, search=None):
+    """
+    Returns (doctors, has_more): one page of doctors ordered by distance from the patient,
+    filtered by specialization and name / city search (see doctor_filters).
+
+    Distances are computed in PostgreSQL. The search starts with a small bounding box
+    (served by idx_doctors_lat_lng) and widens it until the page is filled, so a
+    page view only touches nearby rows. Every doctor within radius r lies inside the
+    box for r, so the order matches a full sort. Doctors without coordinates come
+    last with distance 99999.0 (same as process_doctors_data).
+    `cursor` must be a dict cursor.
+    """
+    need = offset + limit + 1  # one extra row tells us whether a next page exists
+    spec_filter, filter_params = doctor_filters(specialization, search)
+    params = dict(filter_params, lat=float(patient_lat), lng=float(patient_lng), need=need)
+    located = "lat IS NOT NULL AND lng IS NOT NULL AND lat <> 0 AND lng <> 0"
+
+    rows = None
+    for radius in NEAREST_SEARCH_RADII_KM:
+        dlat, dlng = _search_box(params['lat'], radius)
+        if dlng is None or abs(params['lat']) + dlat > 90 or abs(params['lng']) + dlng > 180:
+            break  # Box would wrap around a pole / the antimeridian
+        cursor.execute(f"""
+            SELECT * FROM (
+                SELECT *, {_DOCTOR_DISTANCE_SQL} AS distance
+                FROM doctors
+                WHERE {located} {spec_filter}
+                  AND lat BETWEEN %(lat_min)s AND %(lat_max)s
+                  AND lng BETWEEN %(lng_min)s AND %(lng_max)s
+            ) nearby
+            WHERE distance <= %(radius)s
+            ORDER BY distance, id
+            LIMIT %(need)s
+        """, dict(params, radius=radius,
+                  lat_min=params['lat'] - dlat, lat_max=params['lat'] + dlat,
+                  lng_min=params['lng'] - dlng, lng_max=params['lng'] + dlng))
+        candidates = cursor.fetchall()
+        if len(candidates) >= need:
+            rows = candidates
+            break
+
+    if rows is None:
+        # Page reaches beyond the largest radius: full scan, unlocated doctors last
+        cursor.execute(f"""
+            SELECT *, CASE WHEN {located} THEN {_DOCTOR_DISTANCE_SQL} END AS distance
+            FROM doctors
+            WHERE TRUE {spec_filter}
+            ORDER BY distance NULLS LAST, id
+            LIMIT %(need)s
+        """, params)
+        rows = cursor.fetchall()
+
+    doctors = rows[offset:offset + limit]
+    for d in doctors:
+        d['distance'] = round(float(d['distance']), 1) if d['distance'] is not None else 99999.0
+    return doctors, len(rows) > offset + limit